@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:21:05 2026
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Instrumentation import timed
+
+
+class Backtester(object):
+    # Evaluates any (dates x tickers) weights matrix against a returns matrix.
+    # Weights set on a date are held from that close, so they earn the returns
+    # of the following dates until the next rebalance. Costs are charged on the
+    # traded weights, in return units: linear_cost per unit traded (e.g. 0.0005
+    # for 5bps) plus quadratic_cost per unit traded squared, as an impact proxy.
+
+    def __init__(self, weights_df, returns_df, linear_cost=0.0, quadratic_cost=0.0,
+                 sharpe_window=63, annualization_factor=252):
+        self.linear_cost = linear_cost
+        self.quadratic_cost = quadratic_cost
+        self.sharpe_window = sharpe_window
+        self.annualization_factor = annualization_factor
+        dts = returns_df.index[returns_df.index >= weights_df.index.min()]
+        self.weights_df = weights_df.reindex(dts.union(weights_df.index)).ffill()\
+                                    .reindex(dts).fillna(0)
+        self.returns_df = returns_df.reindex(index=dts, columns=weights_df.columns)
+        self.results_df = None
+
+    @classmethod
+    def from_portfolio(cls, portfolio, **kwargs):
+        # The portfolio classes name their weights differently. 
+        # SimpleBlackLitterman also holds its market cap prior in weights_df, 
+        # so its black_litterman_weights_df is looked up first
+        if hasattr(portfolio, 'stock_obj1_wght_ts'):
+            weights_df = pd.DataFrame({portfolio.stock_obj1.ticker: portfolio.stock_obj1_wght_ts,
+                                       portfolio.stock_obj2.ticker: portfolio.stock_obj2_wght_ts})
+            returns_df = pd.DataFrame({portfolio.stock_obj1.ticker: portfolio.stock_obj1_return,
+                                       portfolio.stock_obj2.ticker: portfolio.stock_obj2_return})
+            return cls(weights_df.dropna(), returns_df, **kwargs)
+        for attribute in ['black_litterman_weights_df', 'weights_df', 'weights', 'weight_df']:
+            if getattr(portfolio, attribute, None) is not None:
+                return cls(getattr(portfolio, attribute), portfolio.returns_df, **kwargs)
+        raise ValueError('No weights found on the portfolio')
+
+    @timed
+    def run(self):
+        W = self.weights_df.values
+        R = np.nan_to_num(self.returns_df.values)
+        W_lagged = np.vstack([np.zeros((1, W.shape[1])), W[:-1]])
+
+        trades = W - W_lagged
+        gross_return = (W_lagged * R).sum(axis=1)
+        turnover = np.abs(trades).sum(axis=1)
+        cost = self.linear_cost * turnover + self.quadratic_cost * (trades ** 2).sum(axis=1)
+        net_return = gross_return - cost
+
+        equity = np.cumprod(1 + net_return)
+        drawdown = equity / np.maximum.accumulate(equity) - 1
+        results_df = pd.DataFrame({'GrossReturn': gross_return,
+                                   'Cost': cost,
+                                   'NetReturn': net_return,
+                                   'Turnover': turnover,
+                                   'Equity': equity,
+                                   'Drawdown': drawdown},
+                                  index=self.weights_df.index)
+        rolling_net = results_df['NetReturn'].rolling(window=self.sharpe_window)
+        results_df['RollingSharpe'] = np.sqrt(self.annualization_factor) * \
+                                      rolling_net.mean() / rolling_net.std()
+        self.results_df = results_df
+        return results_df
+
+    def summary(self):
+        if self.results_df is None:
+            self.run()
+        return performance_summary(self.results_df['NetReturn'],
+                                   turnover_ts=self.results_df['Turnover'],
+                                   cost_ts=self.results_df['Cost'],
+                                   annualization_factor=self.annualization_factor)
+
+
+def performance_summary(return_ts, turnover_ts=None, cost_ts=None, annualization_factor=252):
+    mean_return = return_ts.mean()
+    volatility = return_ts.std()
+    equity = (1 + return_ts).cumprod()
+    summary = {'AnnualizedReturn': mean_return * annualization_factor,
+               'AnnualizedVolatility': volatility * np.sqrt(annualization_factor),
+               'Sharpe': np.sqrt(annualization_factor) * mean_return / volatility,
+               'MaxDrawdown': (equity / equity.cummax() - 1).min(),
+               'NbrObservations': return_ts.count()}
+    if turnover_ts is not None:
+        summary['AvgTurnover'] = turnover_ts.mean()
+    if cost_ts is not None:
+        summary['AnnualizedCost'] = cost_ts.mean() * annualization_factor
+    return pd.Series(summary)
+
+
+def backtest_config(strategy_func, config, returns_df, backtest_kwargs):
+    # strategy_func(**config) returns a weights_df. Module level so that it
+    # can be sent to a worker process
+    weights_df = strategy_func(**config)
+    return Backtester(weights_df, returns_df, **backtest_kwargs).run()['NetReturn']
+
+
+def walk_forward(strategy_func, configs, returns_df, train_window=252, test_window=63,
+                 max_workers=None, **backtest_kwargs):
+    # Every config is backtested independently (over a process pool when
+    # max_workers is set, strategy_func must then be picklable). The dates
+    # are then cut into consecutive test folds; for each fold the config with
+    # the best Sharpe over the preceding train_window dates is held for the
+    # fold. Returns (walk forward return ts, folds_df, (dates x configs)
+    # net returns DataFrame).
+    annualization_factor = backtest_kwargs.get('annualization_factor', 252)
+    if max_workers is None:
+        net_return_arr = [backtest_config(strategy_func, config, returns_df, backtest_kwargs)
+                          for config in configs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(backtest_config, strategy_func, config,
+                                       returns_df, backtest_kwargs) for config in configs]
+            net_return_arr = [f.result() for f in futures]
+    config_returns_df = pd.concat(net_return_arr, axis=1, keys=range(len(configs)))
+
+    # Train Sharpe of every config for every fold from cumulative sums
+    R = config_returns_df.values
+    valid = ~np.isnan(R)
+    R = np.nan_to_num(R)
+    zeros = np.zeros((1, R.shape[1]))
+    cum_n = np.vstack([zeros, np.cumsum(valid, axis=0)])
+    cum_r = np.vstack([zeros, np.cumsum(R, axis=0)])
+    cum_r2 = np.vstack([zeros, np.cumsum(R ** 2, axis=0)])
+    fold_starts = np.arange(train_window, len(R), test_window)
+    n = cum_n[fold_starts] - cum_n[fold_starts - train_window]
+    mean = (cum_r[fold_starts] - cum_r[fold_starts - train_window]) / n
+    var = ((cum_r2[fold_starts] - cum_r2[fold_starts - train_window]) - n * mean ** 2) / (n - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        train_sharpe = np.sqrt(annualization_factor) * mean / np.sqrt(var)
+    train_sharpe = np.where(np.isfinite(train_sharpe), train_sharpe, -np.inf)
+    best = train_sharpe.argmax(axis=1)
+
+    data = []
+    walk_forward_arr = []
+    for start, k in zip(fold_starts, best):
+        end = min(start + test_window, len(R))
+        test_return_ts = config_returns_df.iloc[start:end, k]
+        walk_forward_arr.append(test_return_ts)
+        data.append({'TestStart': config_returns_df.index[start],
+                     'TestEnd': config_returns_df.index[end - 1],
+                     'Config': k,
+                     'TrainSharpe': train_sharpe[len(data), k],
+                     'TestSharpe': performance_summary(test_return_ts,
+                                   annualization_factor=annualization_factor)['Sharpe']})
+    folds_df = pd.DataFrame(data, columns=['TestStart', 'TestEnd', 'Config',
+                                           'TrainSharpe', 'TestSharpe'])
+    walk_forward_return_ts = pd.concat(walk_forward_arr) if walk_forward_arr \
+                             else pd.Series(dtype=float)
+    walk_forward_return_ts.name = 'WalkForwardReturn'
+    return walk_forward_return_ts, folds_df, config_returns_df
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:40:52 2026
+
+"""
+import pandas as pd
+
+# Transforms applied across the tickers of a (dates x tickers) DataFrame, every
+# date at once. groups optionally maps tickers to a group label (e.g. a sector,
+# as a dict or Series), in which case the transform runs within each group.
+
+
+def _group_labels(signal_df, groups):
+    return pd.Series(groups).reindex(signal_df.columns).values
+
+
+def _group_transform(signal_df, groups, func):
+    # func is a groupby transform applied to every (group, date) cell
+    grouped = signal_df.T.groupby(_group_labels(signal_df, groups), dropna=False)
+    return grouped.transform(func).T
+
+
+def Rank_Scale(signal_df, groups = None):
+    # Ranks every date from -1 (lowest) to +1 (highest), NaNs are left out of
+    # the ranking and stay NaN
+    if groups is None:
+        ranks = signal_df.rank(axis=1)
+        counts = signal_df.notna().sum(axis=1)
+        return 2 * (ranks.sub(1).div(counts - 1, axis=0)) - 1
+    ranks = _group_transform(signal_df, groups, 'rank')
+    counts = _group_transform(signal_df, groups, 'count')
+    return 2 * ((ranks - 1) / (counts - 1)) - 1
+
+
+def Long_Short_Normalize(weights_df, threshold = 0.001, groups = None):
+    # Scales the long weights (> threshold) of every date to sum up to 1 and the
+    # short weights (< -threshold) to sum up to -1, others are left untouched
+    long_mask = weights_df > threshold
+    short_mask = weights_df < -threshold
+    long_weights_df = weights_df.where(long_mask)
+    short_weights_df = weights_df.where(short_mask)
+    if groups is None:
+        long_sum = long_weights_df.sum(axis=1)
+        short_sum = short_weights_df.sum(axis=1)
+        normalized_df = weights_df.mask(long_mask, weights_df.div(long_sum, axis=0))
+        return normalized_df.mask(short_mask, weights_df.div(-short_sum, axis=0))
+    long_sum = _group_transform(long_weights_df, groups, 'sum')
+    short_sum = _group_transform(short_weights_df, groups, 'sum')
+    normalized_df = weights_df.mask(long_mask, weights_df / long_sum)
+    return normalized_df.mask(short_mask, weights_df / -short_sum)
+
+
+def Winsorize(signal_df, lower = 0.05, upper = 0.95, groups = None):
+    # Clips every date to its own [lower, upper] quantiles
+    if groups is None:
+        return signal_df.clip(lower=signal_df.quantile(lower, axis=1),
+                              upper=signal_df.quantile(upper, axis=1), axis=0)
+    lower_df = _group_transform(signal_df, groups, lambda x: x.quantile(lower))
+    upper_df = _group_transform(signal_df, groups, lambda x: x.quantile(upper))
+    return signal_df.clip(lower=lower_df, upper=upper_df)
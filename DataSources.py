@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:36:50 2026
+
+"""
+
+import os
+import threading
+import pandas as pd
+
+
+class DataSource(object):
+    # Where a Stock gets its raw frames from. Every method takes a ticker and
+    # returns a DataFrame laid out as the live scrapers return it:
+    #   get_price_history      daily PriceOpen/High/Low/Close and Volume
+    #   get_financial_data     yahooquery all_financial_data, with asOfDate
+    #   get_earnings_calendar  Zacks Quarter and ReleaseDate
+    #   get_ratings            Finviz analyst ratings
+    #   get_insider_trades     Finviz insider trading
+    #   get_news               Finviz news headlines, without sentiment
+    # The live implementation is Stock.LiveDataSource.
+
+    def get_price_history(self, ticker):
+        raise NotImplementedError
+
+    def get_financial_data(self, ticker, fundamental_frequency='q'):
+        raise NotImplementedError
+
+    def get_earnings_calendar(self, ticker):
+        raise NotImplementedError
+
+    def get_ratings(self, ticker):
+        raise NotImplementedError
+
+    def get_insider_trades(self, ticker):
+        raise NotImplementedError
+
+    def get_news(self, ticker):
+        raise NotImplementedError
+
+
+def _replay_file_path(folder, ticker, kind, fundamental_frequency=None):
+    file_name = kind if fundamental_frequency is None else kind + '_' + fundamental_frequency
+    return os.path.join(folder, ticker, file_name + '.pkl')
+
+
+class ReplayDataSource(DataSource):
+    # Serves frames from disk, one pickle per (ticker, kind) under
+    # folder/ticker/, as written by RecordingDataSource or by hand for test
+    # fixtures. Nothing is fetched: a missing file raises FileNotFoundError,
+    # which Stock records like any other failed source.
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def tickers(self):
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(t for t in os.listdir(self.folder)
+                      if os.path.isdir(os.path.join(self.folder, t)))
+
+    def _read(self, ticker, kind, fundamental_frequency=None):
+        file_path = _replay_file_path(self.folder, ticker, kind, fundamental_frequency)
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError('No ' + kind + ' recorded for ' + ticker + ' in ' + self.folder)
+        return pd.read_pickle(file_path)
+
+    def get_price_history(self, ticker):
+        return self._read(ticker, 'price_history')
+
+    def get_financial_data(self, ticker, fundamental_frequency='q'):
+        return self._read(ticker, 'financial_data', fundamental_frequency)
+
+    def get_earnings_calendar(self, ticker):
+        return self._read(ticker, 'earnings_calendar')
+
+    def get_ratings(self, ticker):
+        return self._read(ticker, 'ratings')
+
+    def get_insider_trades(self, ticker):
+        return self._read(ticker, 'insider_trades')
+
+    def get_news(self, ticker):
+        return self._read(ticker, 'news')
+
+
+def write_replay_frame(folder, ticker, kind, df, fundamental_frequency=None):
+    file_path = _replay_file_path(folder, ticker, kind, fundamental_frequency)
+    if not os.path.isdir(os.path.dirname(file_path)):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = file_path + '.' + str(threading.get_ident()) + '.tmp'
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, file_path)
+
+
+class RecordingDataSource(DataSource):
+    # Passes every call through to source and writes what comes back to
+    # folder in the ReplayDataSource layout, so a live run can be replayed
+    # offline later
+
+    def __init__(self, source, folder):
+        self.source = source
+        self.folder = folder
+
+    def _record(self, ticker, kind, df, fundamental_frequency=None):
+        if df is not None:
+            write_replay_frame(self.folder, ticker, kind, df, fundamental_frequency)
+        return df
+
+    def get_price_history(self, ticker):
+        return self._record(ticker, 'price_history', self.source.get_price_history(ticker))
+
+    def get_financial_data(self, ticker, fundamental_frequency='q'):
+        return self._record(ticker, 'financial_data',
+                            self.source.get_financial_data(ticker, fundamental_frequency),
+                            fundamental_frequency)
+
+    def get_earnings_calendar(self, ticker):
+        return self._record(ticker, 'earnings_calendar', self.source.get_earnings_calendar(ticker))
+
+    def get_ratings(self, ticker):
+        return self._record(ticker, 'ratings', self.source.get_ratings(ticker))
+
+    def get_insider_trades(self, ticker):
+        return self._record(ticker, 'insider_trades', self.source.get_insider_trades(ticker))
+
+    def get_news(self, ticker):
+        return self._record(ticker, 'news', self.source.get_news(ticker))
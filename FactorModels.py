@@ -8,9 +8,13 @@ Created on Sun May  2 14:45:13 2021
 from MacroData import get_Fama_French_ts
 from Utils import OLS_regression
 from Utils import align_date_index
+from Utils import rolling_window_sum
 from MacroData import get_Fama_French_Mkt_Return
 import numpy as np
 import pandas as pd
+from RiskModels import CovarianceCube
+from RiskModels import DiagonalCovarianceCube
+from Instrumentation import timed
 
 
 def _DEP_CAPM(stock_obj):
@@ -24,7 +28,6 @@ def _DEP_CAPM(stock_obj):
     
     stock_returns = stock_obj['PriceClose'].pct_change(1).dropna()
     Mkt_Rf_Return_ts = get_Fama_French_ts('Mkt-RF')
-    Mkt_Rf_Return_ts.index = Mkt_Rf_Return_ts.index.map(lambda x: x.date())
     X, Y = align_date_index(obj_1=Mkt_Rf_Return_ts.to_frame(), obj_2=stock_returns)
     regression_dict =  OLS_regression(X=X ,Y=Y , add_constant=True)
     beta_stock = regression_dict['Beta_hat']['Mkt-RF']
@@ -46,6 +49,7 @@ def _DEP_CAPM(stock_obj):
     
     
     
+@timed
 def CAPM(stock_obj_arr, window = 126):
     
     # Given a stock_obj_arr, we get returns of these stocks
@@ -58,72 +62,69 @@ def CAPM(stock_obj_arr, window = 126):
     # Expected returns
     # VAR_COVAR matrix
     # Systematic and Idiosyncratic VARCOVAR matrix
+    # The covariances come back as CovarianceCubes, indexed by date like dicts.
+    # The idiosyncratic one is diagonal and only stores its (dates x stocks)
+    # variances, its matrix of a date is built when the date is looked up.
     
     Mkt_Rf_Return_ts = get_Fama_French_ts('Mkt-RF')
-    Mkt_Rf_Return_ts.index = Mkt_Rf_Return_ts.index.map(lambda x: x.date())
     Mkt_Return_ts = get_Fama_French_Mkt_Return()
-    Mkt_Return_ts.index = Mkt_Return_ts.index.map(lambda x: x.date())
     Rf_Return_ts = get_Fama_French_ts('RF')
-    Rf_Return_ts.index = Rf_Return_ts.index.map(lambda x: x.date())
     arr = [Mkt_Rf_Return_ts, Mkt_Return_ts, Rf_Return_ts]
     for obj in stock_obj_arr:
         stock_returns = obj['PriceClose'].pct_change(1).dropna()
         arr.append(stock_returns)
     aligned_arr = align_date_index(arr)
 
-    # Window loop
-    
-    total_observations = len(aligned_arr[0])
-    nbr_regressions = total_observations - window
+    # All stocks share the same Mkt-RF regressor, so the OLS slope of every 
+    # stock over every window is cov(x, y) / var(x), and the residual variance
+    # follows from the same rolling moments. Data is centered first, which 
+    # leaves these moments unchanged but keeps the rolling sums well conditioned.
+    
+    x = aligned_arr[0].values
+    x = x - x.mean()
+    Y = np.column_stack([stock_ret.values for stock_ret in aligned_arr[3:]])
+    Y = Y - Y.mean(axis=0)
+    Mkt = aligned_arr[1].values
+    Mkt_c = Mkt - Mkt.mean()
+    
+    S_x = rolling_window_sum(x, window)
+    S_xx = rolling_window_sum(x ** 2, window)
+    S_y = rolling_window_sum(Y, window)
+    S_yy = rolling_window_sum(Y ** 2, window)
+    S_xy = rolling_window_sum(x[:, None] * Y, window)
+    
+    Sxx_c = S_xx - S_x ** 2 / window
+    Sxy_c = S_xy - S_x[:, None] * S_y / window
+    Syy_c = S_yy - S_y ** 2 / window
+    
+    beta_arr = Sxy_c / Sxx_c[:, None]
+    var_epsilon_arr = (Syy_c - beta_arr * Sxy_c) / (window - 1)
+    
+    Rf = rolling_window_sum(aligned_arr[2].values, window) / window
+    mu_m = rolling_window_sum(Mkt, window) / window
+    var_m = (rolling_window_sum(Mkt_c ** 2, window) - 
+             rolling_window_sum(Mkt_c, window) ** 2 / window) / (window - 1)
     
     stock_labels = [obj.ticker for obj in stock_obj_arr]
     regression_output_dates = aligned_arr[0].index[window:]
-    Expected_Returns_df = pd.DataFrame(columns=stock_labels, index=regression_output_dates)
-    Covar_Returns_dict = {dt: pd.DataFrame(index=stock_labels, columns=stock_labels) for dt in regression_output_dates}
-    Sys_Covar_Returns_dict = {dt: pd.DataFrame(index=stock_labels, columns=stock_labels) for dt in regression_output_dates}
-    Idio_Covar_Returns_dict = {dt: pd.DataFrame(index=stock_labels, columns=stock_labels) for dt in regression_output_dates}
-    
-    
-    for i in range (nbr_regressions):
-        dt = regression_output_dates[i]
-        X = aligned_arr[0].iloc[i:i+window].to_frame()
-        Rf = aligned_arr[2].iloc[i:i+window].mean()
-        mu_m = aligned_arr[1].iloc[i:i+window].mean() 
-        var_m = aligned_arr[1].iloc[i:i+window].var()
-        
-        beta_arr = []
-        var_epsilon_arr = []
-        
-        
-        for stock_ret in aligned_arr[3:]:
-            Y = stock_ret.iloc[i:i+window]
-            
-            regression_dict =  OLS_regression(X=X ,Y=Y , add_constant=True)
-            beta_stock = regression_dict['Beta_hat']['Mkt-RF']
-            var_epsilon_stock = regression_dict['Epsilon_hat'].var()
-            
-            beta_arr.append(beta_stock)
-            var_epsilon_arr.append(var_epsilon_stock)
-            
-        Expected_Returns_arr = Rf + (mu_m - Rf) * np.array(beta_arr)
-        Covar_Returns_mat = var_m * (np.matrix(beta_arr).T.dot(np.matrix(beta_arr))) + np.diag(var_epsilon_arr)
-        Sys_Covar_Returns_mat = var_m * (np.matrix(beta_arr).T.dot(np.matrix(beta_arr)))
-        Idio_Covar_Returns_mat = np.diag(var_epsilon_arr)
-        
-        
-        Expected_Returns_df.loc[dt, :] = Expected_Returns_arr * 252
-        Covar_Returns_dict[dt].loc[:,:]= Covar_Returns_mat * 252
-        Sys_Covar_Returns_dict[dt].loc[:,:]= Sys_Covar_Returns_mat * 252
-        Idio_Covar_Returns_dict[dt].loc[:,:]= Idio_Covar_Returns_mat * 252
-                
-    return Expected_Returns_df, Covar_Returns_dict, Sys_Covar_Returns_dict, Idio_Covar_Returns_dict
-            
-        
-        
-        
-
-    
     
-    
-    
-    
\ No newline at end of file
+    # Annualized in place, the total covariance is a copy of the systematic
+    # one with the idiosyncratic variances added on its diagonal
+    Expected_Returns_arr = Rf[:, None] + (mu_m - Rf)[:, None] * beta_arr
+    Expected_Returns_arr *= 252
+    var_epsilon_arr *= 252
+    Sys_Covar_Returns_arr = np.einsum('ti,tj->tij', beta_arr, beta_arr)
+    Sys_Covar_Returns_arr *= 252 * var_m[:, None, None]
+    Covar_Returns_arr = Sys_Covar_Returns_arr.copy()
+    diag_idx = np.arange(len(stock_labels))
+    Covar_Returns_arr[:, diag_idx, diag_idx] += var_epsilon_arr
+    
+    Expected_Returns_df = pd.DataFrame(Expected_Returns_arr, 
+                                       index=regression_output_dates, columns=stock_labels)
+    Covar_Returns_cube = CovarianceCube(Covar_Returns_arr, regression_output_dates, stock_labels)
+    Sys_Covar_Returns_cube = CovarianceCube(Sys_Covar_Returns_arr, 
+                                            regression_output_dates, stock_labels)
+    Idio_Covar_Returns_cube = DiagonalCovarianceCube(var_epsilon_arr, 
+                                                     regression_output_dates, stock_labels)
+                
+    return Expected_Returns_df, Covar_Returns_cube, Sys_Covar_Returns_cube, Idio_Covar_Returns_cube
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:44:19 2026
+
+Timers and counters for the data and analytics stages. Off by default; turn
+it on for a whole run with the IKAROS_PROFILE environment variable (set it to
+a .json or .csv path to also write the report at exit), or for a block with
+
+    with profiling() as profiler:
+        ...
+    profiler.export_report('run.json')
+
+When off, every instrumented call costs one attribute check.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+
+class Profiler(object):
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # name => [count, total, min, max] seconds
+            self.timers = {}
+            self.counters = {}
+            self.started = datetime.now().isoformat(timespec='seconds')
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            stats = self.timers.get(name)
+            if stats is None:
+                self.timers[name] = [1, seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = min(stats[2], seconds)
+                stats[3] = max(stats[3], seconds)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def report(self):
+        data = []
+        with self._lock:
+            for name, (n, total, min_sec, max_sec) in sorted(self.timers.items()):
+                data.append({'Name': name, 'Kind': 'timer', 'Count': n,
+                             'TotalSeconds': total, 'MeanSeconds': total / n,
+                             'MinSeconds': min_sec, 'MaxSeconds': max_sec, 'Value': None})
+            for name, value in sorted(self.counters.items()):
+                data.append({'Name': name, 'Kind': 'counter', 'Count': None,
+                             'TotalSeconds': None, 'MeanSeconds': None,
+                             'MinSeconds': None, 'MaxSeconds': None, 'Value': value})
+        return pd.DataFrame(data, columns=['Name', 'Kind', 'Count', 'TotalSeconds', 'MeanSeconds',
+                                           'MinSeconds', 'MaxSeconds', 'Value'])
+
+    def export_report(self, file_path):
+        # .csv writes the report table, anything else JSON
+        if file_path.endswith('.csv'):
+            self.report().to_csv(file_path, index=False)
+            return
+        with self._lock:
+            output = {'started': self.started,
+                      'finished': datetime.now().isoformat(timespec='seconds'),
+                      'timers': {name: {'count': n, 'total_seconds': total,
+                                        'mean_seconds': total / n, 'min_seconds': min_sec,
+                                        'max_seconds': max_sec}
+                                 for name, (n, total, min_sec, max_sec) in self.timers.items()},
+                      'counters': dict(self.counters)}
+        with open(file_path, 'w') as f:
+            json.dump(output, f, indent=1)
+
+
+_profile_setting = os.getenv('IKAROS_PROFILE', '')
+profiler = Profiler(enabled=_profile_setting not in ('', '0'))
+if _profile_setting.endswith('.json') or _profile_setting.endswith('.csv'):
+    atexit.register(profiler.export_report, _profile_setting)
+
+
+def timed(func):
+    # Times every call of func under module.qualname
+    name = func.__module__ + '.' + func.__qualname__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.add_time(name, time.perf_counter() - start)
+    return wrapper
+
+
+def timer(name):
+    return profiler.timer(name)
+
+
+def count(name, value=1):
+    profiler.count(name, value)
+
+
+@contextmanager
+def profiling(reset=True):
+    # Turns profiling on for the block and hands back the profiler, the
+    # previous on/off state is restored on exit
+    previous = profiler.enabled
+    if reset:
+        profiler.reset()
+    profiler.enabled = True
+    try:
+        yield profiler
+    finally:
+        profiler.enabled = previous
@@ -6,9 +6,12 @@ Created on Sat Mar 13 14:41:34 2021
 """
 
 import pandas_datareader.data as web  # module for reading datasets directly from the web
-from datetime import datetime
+from datetime import datetime, timedelta
+import pandas as pd
 import os
+import threading
 from Utils import pandas_csv_cache
+from Instrumentation import timed
 
 
 if os.getenv("IKAROSDATA") is not None:
@@ -19,33 +22,144 @@ else:
         os.mkdir(library_folder)
         
         
-@pandas_csv_cache(folder=os.path.join(library_folder, 'FamaFrench'),
-                  file_template='FamaFrench_Data.csv',
-                  expiration_in_sec=24*60*60,
-                  read_csv_kwargs={'sep': '|',
-                                   'parse_dates': [0],
-                                   'index_col': 0 },
-                  to_csv_kwargs={'index': True,
-                                 'sep': '|'})
-def get_Fama_French_df():
-    F_F_Dataset_Name = 'F-F_Research_Data_Factors_daily'
+def _fetch_Fama_French_df(F_F_Dataset_Name, last_timestamp=None):
+    start = '2000-01-01'
+    if last_timestamp is not None:
+        # Only refresh the last month, enough to pick up revised recent rows
+        start = (pd.Timestamp(last_timestamp) - timedelta(days=31)).strftime('%Y-%m-%d')
     F_F_Data = web.DataReader(F_F_Dataset_Name,'famafrench', 
-                              start='2000-01-01', 
+                              start=start, 
                               end=datetime.today().strftime('%Y-%m-%d')) 
     F_F_df = F_F_Data[0].dropna() / 100 # Scaling data from % to decimal to line up data with returns data
-    F_F_df.index = F_F_df.index.map(lambda x: x.date())
+    F_F_df.columns = F_F_df.columns.str.strip()
     return F_F_df
+
+
+def _Fama_French_cache(file_template):
+    return pandas_csv_cache(folder=os.path.join(library_folder, 'FamaFrench'),
+                            file_template=file_template,
+                            expiration_in_sec=24*60*60,
+                            read_csv_kwargs={'sep': '|',
+                                             'parse_dates': [0],
+                                             'index_col': 0 },
+                            to_csv_kwargs={'index': True,
+                                           'sep': '|'},
+                            storage_format='pickle',
+                            memory_cache_size=1,
+                            incremental_column='index')
+
+
+def _migrate_legacy_Fama_French_cache():
+    # The 3 factors used to be cached as FamaFrench_Data.csv. It is renamed
+    # to the current file, keeping its age, so it is picked up (and refreshed
+    # incrementally once expired) instead of being left behind
+    folder = os.path.join(library_folder, 'FamaFrench')
+    legacy_file_path = os.path.join(folder, 'FamaFrench_Data.csv')
+    if not os.path.isfile(legacy_file_path):
+        return
+    file_path = os.path.join(folder, 'FamaFrench_3_Factors')
+    if os.path.isfile(file_path + '.csv') or os.path.isfile(file_path + '.pkl'):
+        os.remove(legacy_file_path)
+        return
+    legacy_mtime = os.path.getmtime(legacy_file_path)
+    F_F_df = pd.read_csv(legacy_file_path, sep='|', parse_dates=[0], index_col=0)
+    F_F_df.columns = F_F_df.columns.str.strip()
+    F_F_df.to_csv(file_path + '.csv', sep='|', index=True)
+    os.utime(file_path + '.csv', (legacy_mtime, legacy_mtime))
+    os.remove(legacy_file_path)
+
+_migrate_legacy_Fama_French_cache()
+
+
+# The cached frames keep the DatetimeIndex returned by the data reader, see
+# FactorStore for the date indexed views used against stock returns
+@timed
+@_Fama_French_cache('FamaFrench_3_Factors.csv')
+def get_Fama_French_df(cached_df=None, last_timestamp=None):
+    return _fetch_Fama_French_df('F-F_Research_Data_Factors_daily', last_timestamp)
+
+
+@timed
+@_Fama_French_cache('FamaFrench_5_Factors.csv')
+def get_Fama_French_5_Factors_df(cached_df=None, last_timestamp=None):
+    return _fetch_Fama_French_df('F-F_Research_Data_5_Factors_2x3_daily', last_timestamp)
+
+
+@timed
+@_Fama_French_cache('FamaFrench_Momentum.csv')
+def get_Fama_French_Momentum_df(cached_df=None, last_timestamp=None):
+    return _fetch_Fama_French_df('F-F_Momentum_Factor_daily', last_timestamp)
+
+
+class FactorStore(object):
+    # Factor datasets loaded once per process. Each dataset is kept with a
+    # canonical DatetimeIndex, and a date indexed copy of that index is built
+    # once so factor series line up with stock returns without remapping.
+    # set() injects a dataset directly, e.g. synthetic factors in benchmarks.
+
+    def __init__(self, loaders):
+        self.loaders = dict(loaders)
+        self._frames = {}
+        self._date_indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, dataset='3_Factors'):
+        with self._lock:
+            if dataset not in self._frames:
+                if dataset not in self.loaders:
+                    raise KeyError('Unknown factor dataset: ' + str(dataset))
+                self._store(dataset, self.loaders[dataset]())
+            return self._frames[dataset]
+
+    def set(self, dataset, df):
+        with self._lock:
+            self._store(dataset, df)
+
+    def _store(self, dataset, df):
+        df = df.copy()
+        df.index = pd.DatetimeIndex(pd.to_datetime(df.index)).normalize()
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        self._frames[dataset] = df
+        self._date_indexes[dataset] = pd.Index(df.index.date)
+
+    def date_index(self, dataset='3_Factors'):
+        self.get(dataset)
+        return self._date_indexes[dataset]
+
+    def series(self, series_name, dataset='3_Factors', dated=True):
+        # A new Series over the stored column values, so callers may rename or
+        # re-index it without touching the store
+        df = self.get(dataset)
+        index = self.date_index(dataset) if dated else df.index
+        return pd.Series(df[series_name].values, index=index, name=series_name, copy=False)
+
+    def frame(self, dataset='3_Factors', dated=True):
+        df = self.get(dataset)
+        if not dated:
+            return df
+        return df.set_axis(self.date_index(dataset), axis=0, copy=False)
+
+    def clear(self, dataset=None):
+        with self._lock:
+            for cache in [self._frames, self._date_indexes]:
+                if dataset is None:
+                    cache.clear()
+                else:
+                    cache.pop(dataset, None)
+
+
+factor_store = FactorStore({'3_Factors': get_Fama_French_df,
+                            '5_Factors': get_Fama_French_5_Factors_df,
+                            'Momentum': get_Fama_French_Momentum_df})
  
     
-def get_Fama_French_ts(series_name):
-    F_F_df = get_Fama_French_df()
-    F_F_series = F_F_df[series_name]
+def get_Fama_French_ts(series_name, dataset='3_Factors'):
+    F_F_series = factor_store.series(series_name, dataset=dataset)
     return F_F_series
  
 
 def get_Fama_French_Mkt_Return():
-    df = get_Fama_French_df()
-    Mkt_Return_ts = df['Mkt-RF'] + df['RF'] 
+    Mkt_Return_ts = factor_store.series('Mkt-RF') + factor_store.series('RF')
     return Mkt_Return_ts
 
 
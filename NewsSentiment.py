@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:02:27 2026
+
+"""
+
+import os
+import atexit
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from textblob import TextBlob
+
+
+if os.getenv("IKAROSDATA") is not None:
+    library_folder = os.getenv("IKAROSDATA")
+else:
+    library_folder = os.path.join(os.getenv("APPDATA"), "IKAROSDATA")
+    if not os.path.isdir(library_folder):
+        os.mkdir(library_folder)
+
+
+sentiment_columns = ['NewsSentiment', 'NewsSubjectivity']
+
+
+def headline_key(headline):
+    return hashlib.sha1(headline.encode('utf-8')).hexdigest()
+
+
+def score_headlines(headlines):
+    # TextBlob polarity and subjectivity, one parse per headline
+    data = []
+    for headline in headlines:
+        sentiment = TextBlob(headline).sentiment
+        data.append((sentiment.polarity, sentiment.subjectivity))
+    return data
+
+
+class SentimentStore(object):
+    # Headline scores shared across tickers and sessions: the same wire
+    # headline listed under several tickers is only scored once. Scores are
+    # kept in memory keyed by headline hash and written back to file_path.
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._dirty = False
+        if os.path.isfile(file_path):
+            self.scores_df = pd.read_pickle(file_path)
+        else:
+            self.scores_df = pd.DataFrame(columns=sentiment_columns, dtype=float)
+
+    def __len__(self):
+        return len(self.scores_df)
+
+    def missing(self, keys):
+        with self._lock:
+            return [key for key in keys if key not in self.scores_df.index]
+
+    def lookup(self, keys):
+        with self._lock:
+            return self.scores_df.reindex(keys)
+
+    def update(self, scores_df):
+        with self._lock:
+            scores_df = scores_df.loc[~scores_df.index.isin(self.scores_df.index)]
+            if len(scores_df):
+                self.scores_df = pd.concat([self.scores_df, scores_df])
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            folder = os.path.dirname(self.file_path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            tmp_path = self.file_path + '.tmp'
+            self.scores_df.to_pickle(tmp_path)
+            os.replace(tmp_path, self.file_path)
+            self._dirty = False
+
+    def clear(self):
+        with self._lock:
+            self.scores_df = self.scores_df.iloc[:0]
+            self._dirty = True
+
+
+sentiment_store = SentimentStore(os.path.join(library_folder, 'NewsSentiment',
+                                              'HeadlineSentiment.pkl'))
+atexit.register(sentiment_store.save)
+
+
+def score_new_headlines(headlines, store=None, max_workers=None, batch_size=500):
+    # Scores the headlines the store has not seen yet. With max_workers, large
+    # backlogs are split in batches of batch_size and scored across a process pool
+    if store is None:
+        store = sentiment_store
+    headlines = list(dict.fromkeys(headlines))
+    keys = [headline_key(h) for h in headlines]
+    missing = set(store.missing(keys))
+    new_headlines = [h for h, key in zip(headlines, keys) if key in missing]
+    if len(new_headlines) == 0:
+        return 0
+
+    if max_workers is not None and max_workers > 1 and len(new_headlines) > batch_size:
+        batches = [new_headlines[i:i+batch_size]
+                   for i in range(0, len(new_headlines), batch_size)]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            scores = [s for batch_scores in executor.map(score_headlines, batches)
+                      for s in batch_scores]
+    else:
+        scores = score_headlines(new_headlines)
+
+    store.update(pd.DataFrame(scores, columns=sentiment_columns,
+                              index=[headline_key(h) for h in new_headlines]))
+    return len(new_headlines)
+
+
+def add_news_sentiment(news_df, store=None, max_workers=None, batch_size=500):
+    # Returns a copy of news_df with the NewsSentiment and NewsSubjectivity
+    # columns filled from the store, scoring unseen headlines first
+    if store is None:
+        store = sentiment_store
+    headlines = news_df['NewsHeadlines'].astype(str)
+    score_new_headlines(headlines, store=store, max_workers=max_workers,
+                        batch_size=batch_size)
+    scores_df = store.lookup([headline_key(h) for h in headlines])
+    return news_df.assign(**{c: scores_df[c].values for c in sentiment_columns})
@@ -4,12 +4,29 @@ Created on Sat Feb 13 13:59:04 2021
 
 @author: saidsa
 """
-from copy import deepcopy
 import pandas as pd
 import numpy as np
 from numpy.linalg import inv
 from Stock import Stock
+from Stock import StockUniverse
+from RiskModels import MatrixCube
+from RiskModels import CovarianceCube
+from RiskModels import shrink_var_covar_arrays
+from RiskModels import RollingVarCovar
+from RiskModels import CumulativeMoments
+from RiskModels import cholesky_stack
+from RiskModels import cholesky_solve_stack
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
 from scipy.stats import norm
+from SignalTransformers import Z_Score
+from CrossSectionalTransformers import Rank_Scale
+from CrossSectionalTransformers import Long_Short_Normalize
+from Backtester import Backtester
+from Instrumentation import timed
 
 def normalize (x):
     #Scaling positive values so that they sum up to 1
@@ -18,6 +35,29 @@ def normalize (x):
     x[x<-0.001] = x[x<-0.001] / - x[x<-0.001].sum()
     return x
 
+def load_stock_arr(stock_arr, max_workers=8, prefetch=False):
+    # Tickers in stock_arr are loaded concurrently, Stock objects are kept as is.
+    # prefetch lists the lazy attributes fetched in the loader pool (True for
+    # all of them); the others, by default all but prices, are fetched on first use
+    tickers = [s for s in stock_arr if isinstance(s, str)]
+    universe = StockUniverse.load(tickers, max_workers=max_workers, raise_errors=True,
+                                  prefetch=prefetch)
+    return [universe[s] if isinstance(s, str) else s for s in stock_arr]
+
+def signal_prefetch(signal_func_arr, attributes=[]):
+    # The lazy Stock attributes read by the signals (see Signals.uses_data)
+    # plus attributes, to be fetched when loading tickers. A signal that does
+    # not declare what it reads prefetches everything.
+    prefetch = list(attributes)
+    for signal_func in signal_func_arr:
+        if signal_func is None:
+            continue
+        data_attributes = getattr(signal_func, 'data_attributes', None)
+        if data_attributes is None:
+            return True
+        prefetch += [a for a in data_attributes if a not in prefetch]
+    return prefetch
+
 def stock_obj_arr_to_return_mat(stock_obj_arr):
     output_dict = {}
     for s in stock_obj_arr:
@@ -33,6 +73,7 @@ def stock_obj_arr_to_signal_mat(stock_obj_arr, signal_func):
     signal_df = pd.DataFrame(output_dict)
     return signal_df.dropna() 
 
+@timed
 def return_mat_to_rolling_var_covar_dict(returns_mat, window=126, 
                                          shrinkage_factor=0.8):
     var_covar_ts = {}
@@ -48,13 +89,36 @@ def return_mat_to_rolling_var_covar_dict(returns_mat, window=126,
         var_covar_ts[dt] = var_cov
     return var_covar_ts
 
+@timed
+def return_mat_to_rolling_var_covar_cube(returns_mat, window=126, 
+                                         shrinkage_factor=0.8):
+    # Same matrices as return_mat_to_rolling_var_covar_dict, built from 
+    # running sums into a single (T, N, N) CovarianceCube
+    return CovarianceCube.from_returns(returns_mat, window=window,
+                                       shrinkage_factor=shrinkage_factor,
+                                       annualization_factor=252)
+
+@timed
 def invert_var_covar_dict(var_covar_ts_dict):
-    inv_var_covar_ts = deepcopy(var_covar_ts_dict)
+    if isinstance(var_covar_ts_dict, CovarianceCube):
+        return CovarianceCube(inv(var_covar_ts_dict.values), 
+                              var_covar_ts_dict.dates, var_covar_ts_dict.tickers)
+    inv_var_covar_ts = {}
     for dt, var_cov_mat in var_covar_ts_dict.items():
-        #Updating the values inside inv_var_covar_ts to preserve the structure
-        #when doing inverse
-        inv_var_covar_ts[dt].loc[:, :] = inv(var_cov_mat)
+        inv_var_covar_ts[dt] = pd.DataFrame(inv(var_cov_mat), index=var_cov_mat.index,
+                                            columns=var_cov_mat.columns)
     return inv_var_covar_ts
+
+def _whiten_stack(Sig, vec_arr):
+    # Given (T, N, N) Sig and a list of (T, N) vectors, factorize Sig = L L'
+    # once and return L and the whitened vectors L^-1 v. Quadratic forms
+    # v' Sig^-1 u are then plain dot products of whitened vectors.
+    L = cholesky_stack(Sig)
+    z = cholesky_solve_stack(L, np.stack([np.asarray(v, dtype=float) for v in vec_arr], axis=-1))
+    return L, [z[..., j] for j in range(len(vec_arr))]
+
+def _dot_stack(a, b):
+    return np.einsum('tn,tn->t', a, b)
     
 def MVOpt_LS_Fixed_risk(r, Sig, s, Sig_inv = None):
     # r is the returns vector for a given day
@@ -64,6 +128,15 @@ def MVOpt_LS_Fixed_risk(r, Sig, s, Sig_inv = None):
     # we want to construct a Long Short Portfolio that maximizes returns with respect 
     # to weights such that the sum of weights is = 0 (constraint 1)
     # and the variance if the portfolio is equal to s (constarint 2)
+    # Passing (T, N) r and (T, N, N) Sig (or a CovarianceCube) solves every
+    # day at once with a stacked Cholesky factorization and returns (T, N) weights
+    
+    if np.ndim(Sig) == 3 or isinstance(Sig, CovarianceCube):
+        L, (z_o, z_r) = _whiten_stack(Sig, [np.ones(np.shape(r)), r])
+        lam_2 = _dot_stack(z_o, z_r) / _dot_stack(z_o, z_o)
+        z_r_lam2_1 = z_r - lam_2[:, None] * z_o
+        lam_1 = np.sqrt(_dot_stack(z_r_lam2_1, z_r_lam2_1) / (4 * s))
+        return cholesky_solve_stack(L, z_r_lam2_1, transpose=True) / (2 * lam_1[:, None])
     
     if Sig_inv is None:
         Sig_inv = inv(Sig)   
@@ -82,6 +155,16 @@ def MVOpt_LS_Fixed_risk_beta(r, Sig, s, beta, Sig_inv = None):
     # adding 3rd constraint: weights * beta = 0 => hedging portfolio
     # beta vector same shape as returns, for a given day, we have a vector of betas
     # and a vector of returns
+    if np.ndim(Sig) == 3 or isinstance(Sig, CovarianceCube):
+        L, (z_o, z_b, z_r) = _whiten_stack(Sig, [np.ones(np.shape(r)), beta, r])
+        A = np.stack([np.stack([_dot_stack(z_o, z_o), _dot_stack(z_o, z_b)], axis=-1),
+                      np.stack([_dot_stack(z_b, z_o), _dot_stack(z_b, z_b)], axis=-1)], axis=-2)
+        b = np.stack([_dot_stack(z_o, z_r), _dot_stack(z_b, z_r)], axis=-1)
+        lam = np.linalg.solve(A, b[..., None])[..., 0]
+        z_r_lam_2_lam_3 = z_r - lam[:, [0]] * z_o - lam[:, [1]] * z_b
+        lam_1 = np.sqrt(_dot_stack(z_r_lam_2_lam_3, z_r_lam_2_lam_3) / (4 * s))
+        return cholesky_solve_stack(L, z_r_lam_2_lam_3, transpose=True) / (2 * lam_1[:, None])
+    
     if Sig_inv is None:
         Sig_inv = inv(Sig) 
     o = np.ones_like(r)
@@ -103,6 +186,13 @@ def MVOpt_LS_Fixed_risk_beta(r, Sig, s, beta, Sig_inv = None):
     
 def MVOpt_L_Min_Var(Sig, Sig_inv = None):
     
+    if np.ndim(Sig) == 3 or isinstance(Sig, CovarianceCube):
+        if isinstance(Sig, CovarianceCube):
+            Sig = Sig.values
+        L, (z_o,) = _whiten_stack(Sig, [np.ones(Sig.shape[:2])])
+        lam_1 = 1 / _dot_stack(z_o, z_o)
+        return lam_1[:, None] * cholesky_solve_stack(L, z_o, transpose=True)
+    
     if Sig_inv is None:
         Sig_inv = inv(Sig)   
     o = np.ones(Sig.shape[0])
@@ -112,69 +202,170 @@ def MVOpt_L_Min_Var(Sig, Sig_inv = None):
     return w
   
        
+def _date_chunks(nbr_dates, chunk_size=None):
+    if chunk_size is None or chunk_size <= 0:
+        chunk_size = max(nbr_dates, 1)
+    for start in range(0, nbr_dates, chunk_size):
+        yield slice(start, min(start + chunk_size, nbr_dates))
+
+def _date_rows(dates, dts):
+    # Positions of dts in dates, as a slice when they are contiguous so that
+    # the rows of a stack can be taken as views instead of copies
+    idx = dates.get_indexer(dts)
+    if len(idx) > 0 and (np.diff(idx) == 1).all():
+        return slice(idx[0], idx[-1] + 1)
+    return idx
+
+def _chunk_rows(arr, rows, chunk):
+    # Rows of arr for the dates in chunk. rows maps the dates to rows of arr
+    # as returned by _date_rows, None when they line up one to one
+    if rows is None:
+        return arr[chunk]
+    if isinstance(rows, slice):
+        return arr[rows.start + chunk.start:rows.start + chunk.stop]
+    return arr[rows[chunk]]
+
+def BL_view_var_covar_tensor(P, Sig, tau=1.0, shrinkage_factor=0.8, chunk_size=None, 
+                             Sig_rows=None):
+    # P is the (T, K, N) link tensor and Sig the (T, N, N) var_covar stack, or
+    # a longer stack with Sig_rows giving the row of each of the T dates. 
+    # Returns the (T, K, K) shrunk Omega = tau * P Sig P' for every date
+    Omega = np.empty(P.shape[:2] + P.shape[1:2])
+    for chunk in _date_chunks(len(P), chunk_size):
+        P_chunk = P[chunk]
+        Omega[chunk] = tau * np.matmul(np.matmul(P_chunk, _chunk_rows(Sig, Sig_rows, chunk)), 
+                                       np.swapaxes(P_chunk, -1, -2))
+    return shrink_var_covar_arrays(Omega, shrinkage_factor)
+
+def BL_weights_tensor(P, Sig, Pi, Q, Omega, tau=1.0, chunk_size=None, Sig_rows=None):
+    # Black Litterman weights tau * Sig^-1 Pi + P' Omega^-1 Q for every date,
+    # using batched solves. P is (T, K, N), Sig (T, N, N) or a longer stack
+    # indexed by Sig_rows, Pi (T, N), Q (K,) and Omega (T, K, K). chunk_size 
+    # bounds the number of dates held in intermediate arrays at once.
+    Q = np.asarray(Q, dtype=float)
+    w = np.empty(Pi.shape)
+    for chunk in _date_chunks(len(P), chunk_size):
+        L = cholesky_stack(_chunk_rows(Sig, Sig_rows, chunk))
+        Sig_inv_Pi = cholesky_solve_stack(L, cholesky_solve_stack(L, Pi[chunk]), transpose=True)
+        Omega_inv_Q = np.linalg.solve(Omega[chunk], 
+                                      np.broadcast_to(Q, Omega[chunk].shape[:2])[..., None])[..., 0]
+        w[chunk] = tau * Sig_inv_Pi + np.einsum('tkn,tk->tn', P[chunk], Omega_inv_Q)
+    return w
+       
+def _append_returns_row(portfolio, new_returns_row):
+    # Shared by the online update of the mean variance classes. Takes the next
+    # day of returns (a Series named by its date, indexed by ticker), returns
+    # the date, the annualized shrunk var_covar of the window that ends the day
+    # before it and the window mean, then slides the window over the new row.
+    dt = new_returns_row.name
+    if dt is None:
+        raise ValueError('new_returns_row must be named by its date')
+    if dt in portfolio.returns_df.index:
+        raise ValueError('Returns for ' + str(dt) + ' are already included')
+    if not dt > portfolio.returns_df.index[-1]:
+        raise ValueError('Returns for ' + str(dt) + ' are not after the last date ' + 
+                         str(portfolio.returns_df.index[-1]))
+    new_returns_row = new_returns_row[portfolio.returns_df.columns]
+    # A missing return would make the running sums NaN for good, the batch
+    # path drops such dates so the caller has to fill or skip them here too
+    missing_tickers = list(new_returns_row.index[new_returns_row.isnull()])
+    if missing_tickers:
+        raise ValueError('Missing returns on ' + str(dt) + ' for ' + ', '.join(map(str, missing_tickers)))
+    
+    var_cov = shrink_var_covar_arrays(portfolio.rolling_var_covar.var_covar() * 252, 
+                                      portfolio.shrinkage_factor)
+    mean_returns = portfolio.rolling_var_covar.mean()
+    
+    portfolio.returns_shifted_df.loc[dt] = portfolio.returns_df.iloc[-1]
+    portfolio.returns_df.loc[dt] = new_returns_row
+    portfolio.var_covar_ts.append(dt, var_cov)
+    portfolio.rolling_var_covar.push(new_returns_row.values)
+    return dt, var_cov, mean_returns
+
 class MeanVarianceOptimization(object):
-    def __init__(self, stock_arr, s = 0.35, shrinkage_factor=0.80):
-        self.stock_arr = [Stock(s) if isinstance(s, str) else s for s in stock_arr]
+    def __init__(self, stock_arr, s = 0.35, shrinkage_factor=0.80, window=126):
+        self.stock_arr = load_stock_arr(stock_arr)
         self.s = s
         self.shrinkage_factor = shrinkage_factor
+        self.window = window
         self.returns_df = stock_obj_arr_to_return_mat(self.stock_arr)
         self.returns_shifted_df = self.returns_df.shift(1)
-        self.var_covar_ts = return_mat_to_rolling_var_covar_dict(self.returns_df, 
-                                    window=126, 
+        self.var_covar_ts = return_mat_to_rolling_var_covar_cube(self.returns_df, 
+                                    window=self.window, 
                                     shrinkage_factor=self.shrinkage_factor)
-        self.inv_var_covar_ts = invert_var_covar_dict(var_covar_ts_dict=self.var_covar_ts)
-        self.expected_returns_df = self.returns_df.rolling(window = 126).mean().shift(1).dropna()*252
+        self.expected_returns_df = self.returns_df.rolling(window = self.window).mean().shift(1).dropna()*252
+        self.rolling_var_covar = RollingVarCovar(self.returns_df.values, window=self.window)
         self.weights_df = self.build_weights()
         
+    @timed
     def build_weights(self):
-        weights_dict = {}
-        for dt, Sig_inv in self.inv_var_covar_ts.items():
-            # for a given day, construct the weights of your protfolio
-            r = self.expected_returns_df.loc[dt,:]
-            Sig = self.var_covar_ts[dt]
-            w = MVOpt_LS_Fixed_risk(r = r, Sig = Sig, s = self.s, Sig_inv = Sig_inv)
-            weights_dict[dt] = w
-        weights_df = pd.DataFrame(weights_dict).T
+        # construct the weights of your protfolio for every day at once
+        dts = self.var_covar_ts.dates
+        r = self.expected_returns_df.loc[dts, :].values
+        w = MVOpt_LS_Fixed_risk(r = r, Sig = self.var_covar_ts, s = self.s)
+        weights_df = pd.DataFrame(w, index=dts, columns=self.var_covar_ts.tickers)
         return weights_df
+    
+    def update(self, new_returns_row):
+        # Online mode: append one new day of returns and one row of weights
+        # without recomputing the history
+        dt, Sig, mean_returns = _append_returns_row(self, new_returns_row)
+        r = mean_returns * 252
+        self.expected_returns_df.loc[dt] = r
+        w = MVOpt_LS_Fixed_risk(r = r[None, :], Sig = Sig[None, :, :], s = self.s)[0]
+        self.weights_df.loc[dt] = w
+        return self.weights_df.loc[dt]
         
     
 class MinVarianceOptimization(object):
     def __init__(self, stock_arr, shrinkage_factor=0.80, window=126):
-        self.stock_arr = [Stock(s) if isinstance(s, str) else s for s in stock_arr]
+        self.stock_arr = load_stock_arr(stock_arr)
         self.shrinkage_factor = shrinkage_factor
         self.window = window
         self.returns_df = stock_obj_arr_to_return_mat(self.stock_arr)
         self.returns_shifted_df = self.returns_df.shift(1)
-        self.var_covar_ts = return_mat_to_rolling_var_covar_dict(self.returns_df, 
+        self.var_covar_ts = return_mat_to_rolling_var_covar_cube(self.returns_df, 
                                     window=self.window, 
                                     shrinkage_factor=self.shrinkage_factor)
-        self.inv_var_covar_ts = invert_var_covar_dict(var_covar_ts_dict=self.var_covar_ts)
+        self.rolling_var_covar = RollingVarCovar(self.returns_df.values, window=self.window)
         self.weights_df = self.build_weights()
         
+    @timed
     def build_weights(self):
-        weights_dict = {}
-        for dt, Sig_inv in self.inv_var_covar_ts.items():
-            # for a given day, construct the weights of your protfolio
-            Sig = self.var_covar_ts[dt]
-            w = MVOpt_L_Min_Var(Sig = Sig, Sig_inv = Sig_inv)
-            weights_dict[dt] = w
-        weights_df = pd.DataFrame(weights_dict).T
+        # construct the weights of your protfolio for every day at once
+        w = MVOpt_L_Min_Var(Sig = self.var_covar_ts)
+        weights_df = pd.DataFrame(w, index=self.var_covar_ts.dates, 
+                                  columns=self.var_covar_ts.tickers)
         return weights_df    
+    
+    def update(self, new_returns_row):
+        # Online mode: append one new day of returns and one row of weights
+        # without recomputing the history
+        dt, Sig, mean_returns = _append_returns_row(self, new_returns_row)
+        self.weights_df.loc[dt] = MVOpt_L_Min_Var(Sig = Sig[None, :, :])[0]
+        return self.weights_df.loc[dt]
 
     
 class SimpleBlackLitterman(object):
+    # Views are held as a (dates x signals x stocks) link tensor and every
+    # date is solved at once, chunk_size dates at a time to bound memory
 
     def __init__(self, stock_arr, signal_func_arr, signal_view_ret_arr,
-                 A=1.0, tau=1.0, shrinkage_factor=0.80):
+                 A=1.0, tau=1.0, shrinkage_factor=0.80, chunk_size=None, window=126):
         
         
-        self.stock_arr = [Stock(s) if isinstance(s, str) else s for s in stock_arr]
+        # The market cap prior reads ShareIssued from the fundamentals
+        self.stock_arr = load_stock_arr(stock_arr, 
+                                        prefetch=signal_prefetch(signal_func_arr, 
+                                                                 Stock.fundamental_attributes))
         
         self.signal_func_arr = signal_func_arr
         self.signal_view_ret_arr = signal_view_ret_arr
         self.A = A
         self.tau = tau
         self.shrinkage_factor = shrinkage_factor
+        self.chunk_size = chunk_size
+        self.window = window
         
         self.returns_df = stock_obj_arr_to_return_mat(self.stock_arr)
         self.returns_shifted_df = self.returns_df.shift(1)
@@ -182,16 +373,14 @@ class SimpleBlackLitterman(object):
         self.weights_df = self.build_weights()
         self.weights_shifted_df = self.weights_df.shift(1)
         
-        self.var_covar_ts = return_mat_to_rolling_var_covar_dict(self.returns_df, 
-                                    window=126, 
+        self.var_covar_ts = return_mat_to_rolling_var_covar_cube(self.returns_df, 
+                                    window=self.window, 
                                     shrinkage_factor=self.shrinkage_factor)
-        self.inv_var_covar_ts = invert_var_covar_dict(var_covar_ts_dict=self.var_covar_ts)
         
         self.implied_returns_df = self.generate_implied_returns()
         self.signal_df_dict = {'signal_'+str(i):self.build_signal_df(sf).dropna() \
                                for i, sf in enumerate(self.signal_func_arr)}
         
-        self.signal_ts_dict = self.generate_signal_ts_dict()
         self.link_mat_ts = self.generate_link_mats()
         
         self.view_var_covar_ts = self.generate_view_var_covar_mats()
@@ -200,24 +389,32 @@ class SimpleBlackLitterman(object):
         self.black_litterman_weights_df = self.generate_black_litterman_weights()
         
 
+    @timed
     def build_weights(self):
         output_dict = {}
         for s in self.stock_arr:
             output_dict[s.ticker] = s['PriceClose'] * s['ShareIssued']
         marketcap_df = pd.DataFrame(output_dict).dropna()   
-        weights_df = marketcap_df.apply(lambda x: normalize(x), axis = 1)
+        weights_df = Long_Short_Normalize(marketcap_df)
         return weights_df
        
 
+    def _var_covar_rows(self, dts):
+        return _date_rows(self.var_covar_ts.dates, dts)
+
     def generate_implied_returns(self):
-        implied_returns_dict = {}
-        for dt, var_cov_mat in self.var_covar_ts.items():
-            if dt in self.weights_shifted_df.index:
-                
-                weigts_arr = self.weights_shifted_df.loc[dt, :]            
-                implied_returns_arr = self.A*var_cov_mat.dot(weigts_arr)            
-                implied_returns_dict[dt] = implied_returns_arr
-        implied_returns_df = pd.DataFrame(implied_returns_dict).T.dropna()
+        # Pi = A * Sigma * w for every date, chunk_size dates at a time
+        tickers = self.var_covar_ts.tickers
+        dts = self.var_covar_ts.dates
+        dts = dts[dts.isin(self.weights_shifted_df.index)]
+        weights_arr = self.weights_shifted_df.loc[dts, tickers].values
+        Sig_rows = self._var_covar_rows(dts)
+        implied_returns_arr = np.empty(weights_arr.shape)
+        for chunk in _date_chunks(len(dts), self.chunk_size):
+            implied_returns_arr[chunk] = self.A * np.einsum('tij,tj->ti', 
+                                         _chunk_rows(self.var_covar_ts.values, Sig_rows, chunk), 
+                                         weights_arr[chunk])
+        implied_returns_df = pd.DataFrame(implied_returns_arr, index=dts, columns=tickers).dropna()
         return implied_returns_df
         
 
@@ -230,7 +427,9 @@ class SimpleBlackLitterman(object):
         signal_df = pd.DataFrame(signal_dict)
         return signal_df
 
-    def generate_signal_ts_dict(self):
+    def generate_link_mats(self):
+        # Every signal is ranked across stocks on all of its dates at once, the
+        # ranks are stacked into a (dates x signals x stocks) MatrixCube
         dts = None
         for signal_label, signal_df in self.signal_df_dict.items():
             if dts is None:
@@ -238,56 +437,45 @@ class SimpleBlackLitterman(object):
             else:
                 dts = dts.intersection(signal_df.index)
 
-        output_dict = {}
-        for dt in dts:
-            date_dict = {}
-            for signal_label, signal_df in self.signal_df_dict.items():
-                date_dict[signal_label] = signal_df.loc[dt, :]
-
-            date_df = pd.DataFrame(date_dict).T
-            output_dict[dt] = date_df
-        return output_dict
-        
-
-    def generate_link_mats(self):
-        link_mat_ts = {}
-        for dt, signal_raw in self.signal_ts_dict.items():
-            link_mat_ts[dt] = signal_raw.apply( lambda x: 2*((x.rank() - 1) / ( np.sum(~np.isnan(x)) - 1)) - 1, axis=1).fillna(0)
-        return link_mat_ts
+        tickers = self.var_covar_ts.tickers
+        signal_labels = list(self.signal_df_dict.keys())
+        link_arr = np.stack([Rank_Scale(self.signal_df_dict[signal_label].loc[dts, tickers])\
+                             .fillna(0).values for signal_label in signal_labels], axis=1)
+        return MatrixCube(link_arr, dts, signal_labels, tickers)
 
     def generate_view_var_covar_mats(self):
-        view_var_covar_ts = {}
-        for dt, var_cov_mat in self.var_covar_ts.items():
-            if dt in self.link_mat_ts:
-                P = self.link_mat_ts[dt]
-                Sigma = self.var_covar_ts[dt]
-                Omega = self.tau*P.dot(Sigma).dot(P.T)
-                # Apply shrinkage factor
-                Omega = Omega * self.shrinkage_factor + \
-                          (1.0-self.shrinkage_factor)*np.diag(np.diag(Omega))               
-                view_var_covar_ts[dt] = Omega
-        return view_var_covar_ts
+        dts = self.var_covar_ts.dates
+        dts = dts[dts.isin(self.link_mat_ts.dates)]
+        P = self.link_mat_ts.values[self.link_mat_ts.dates.get_indexer(dts)]
+        Omega = BL_view_var_covar_tensor(P, self.var_covar_ts.values, tau=self.tau,
+                                         shrinkage_factor=self.shrinkage_factor,
+                                         chunk_size=self.chunk_size, 
+                                         Sig_rows=self._var_covar_rows(dts))
+        return CovarianceCube(Omega, dts, self.link_mat_ts.index)
 
 
     def generate_view_inv_var_covar_mats(self):
-        view_inv_var_covar_ts = deepcopy(self.view_var_covar_ts)
-        for dt, view_var_cov_mat in self.view_var_covar_ts.items():
-            view_inv_var_covar_ts[dt].loc[:, :] = inv(view_var_cov_mat)
-        return view_inv_var_covar_ts        
+        return invert_var_covar_dict(self.view_var_covar_ts)        
 
+    @timed
     def generate_black_litterman_weights(self):
-        black_litterman_weights_dict = {}
-        for dt, view_inv_var_cov_mat in self.view_inv_var_covar_ts.items():
-            if dt in self.implied_returns_df.index:
-                black_litterman_weights_dict[dt] = self.tau*(self.inv_var_covar_ts[dt].dot(self.implied_returns_df.loc[dt])) \
-                        + self.link_mat_ts[dt].T.dot(view_inv_var_cov_mat).dot(self.signal_view_ret_arr)
-        black_litterman_weights_df = pd.DataFrame(black_litterman_weights_dict).T
+        dts = self.view_var_covar_ts.dates
+        dts = dts[dts.isin(self.implied_returns_df.index)]
+        P = self.link_mat_ts.values[self.link_mat_ts.dates.get_indexer(dts)]
+        Omega = self.view_var_covar_ts.values[self.view_var_covar_ts.dates.get_indexer(dts)]
+        w = BL_weights_tensor(P, self.var_covar_ts.values, 
+                              Pi=self.implied_returns_df.loc[dts].values,
+                              Q=self.signal_view_ret_arr, Omega=Omega, tau=self.tau,
+                              chunk_size=self.chunk_size, Sig_rows=self._var_covar_rows(dts))
+        black_litterman_weights_df = pd.DataFrame(w, index=dts, columns=self.var_covar_ts.tickers)
         return black_litterman_weights_df
 
 
 class PairTradingPortfolio(object):
     
     def __init__(self, stock_obj1 , stock_obj2, signal_func, flip_signal=False):
+        stock_obj1, stock_obj2 = load_stock_arr([stock_obj1, stock_obj2], 
+                                                prefetch=signal_prefetch([signal_func]))
         self.stock_obj1 = stock_obj1
         self.stock_obj2 = stock_obj2
         self.signal_func = signal_func
@@ -302,20 +490,22 @@ class PairTradingPortfolio(object):
         
         
     def relative_scaling(self, window = 90):
-        self.relative_signal_ts = (self.stock_obj1_signal_ts / self.stock_obj2_signal_ts).rolling(window = window).apply(lambda x: (x[-1] - x[0:-1].mean())/(x[0:-1].std()))
+        self.relative_signal_ts = Z_Score(self.stock_obj1_signal_ts / self.stock_obj2_signal_ts, window = window)
         if self.flip_signal:
             self.relative_signal_ts = -1 * self.relative_signal_ts
-        self.stock_obj1_wght_ts = self.relative_signal_ts.apply(lambda x: (norm.cdf(x) * 2) - 1)
+        self.stock_obj1_wght_ts = pd.Series((norm.cdf(self.relative_signal_ts) * 2) - 1,
+                                            index=self.relative_signal_ts.index)
         self.stock_obj2_wght_ts = -1 * self.stock_obj1_wght_ts
 
         self.portfolio_return_ts = self.stock_obj1_wght_ts.shift(1) * self.stock_obj1_return + \
         self.stock_obj2_wght_ts.shift(1) * self.stock_obj2_return
     
     def relative_differencing(self, window = 90):
-        self.relative_signal_ts = (self.stock_obj1_signal_ts - self.stock_obj2_signal_ts).rolling(window = window).apply(lambda x: (x[-1] - x[0:-1].mean())/(x[0:-1].std()))
+        self.relative_signal_ts = Z_Score(self.stock_obj1_signal_ts - self.stock_obj2_signal_ts, window = window)
         if self.flip_signal:
             self.relative_signal_ts = -1 * self.relative_signal_ts
-        self.stock_obj1_wght_ts = self.relative_signal_ts.apply(lambda x: (norm.cdf(x) * 2) - 1)
+        self.stock_obj1_wght_ts = pd.Series((norm.cdf(self.relative_signal_ts) * 2) - 1,
+                                            index=self.relative_signal_ts.index)
         self.stock_obj2_wght_ts = -1 * self.stock_obj1_wght_ts
 
         self.portfolio_return_ts = self.stock_obj1_wght_ts.shift(1) * self.stock_obj1_return + \
@@ -328,10 +518,118 @@ class PairTradingPortfolio(object):
     
         
         
+_pair_scan_data = {}
+
+def _init_pair_scan_worker(signal_arr, returns_arr):
+    # Ships the signal and returns matrices to a worker process once, rather
+    # than with every shard
+    _pair_scan_data['signal_arr'] = signal_arr
+    _pair_scan_data['returns_arr'] = returns_arr
+
+def pair_scan_shard(pairs, window=90, relative_method='differencing', flip_signal=False,
+                    signal_arr=None, returns_arr=None):
+    # Evaluates every (i, j) column pair of the (T, N) signal and returns 
+    # matrices the way PairTradingPortfolio does, all pairs of the shard at 
+    # once: rolling z-score of the relative signal, weight norm.cdf(z)*2 - 1 
+    # on stock i and the opposite on stock j, held from the next day on.
+    if signal_arr is None:
+        signal_arr = _pair_scan_data['signal_arr']
+        returns_arr = _pair_scan_data['returns_arr']
+    pairs = np.asarray(pairs)
+    i, j = pairs[:, 0], pairs[:, 1]
+    if relative_method == 'scaling':
+        relative_signal = signal_arr[:, i] / signal_arr[:, j]
+    else:
+        relative_signal = signal_arr[:, i] - signal_arr[:, j]
+    
+    z = Z_Score(pd.DataFrame(relative_signal), window = window).values
+    if flip_signal:
+        z = -1 * z
+    w = (norm.cdf(z) * 2) - 1
+    w_shifted = np.vstack([np.full((1, len(pairs)), np.nan), w[:-1]])
+    pair_returns = w_shifted * (returns_arr[:, i] - returns_arr[:, j])
+    
+    valid = ~np.isnan(pair_returns)
+    nbr_obs = valid.sum(axis=0)
+    # Pairs whose z-score is never defined (e.g. identical signals) give NaN stats
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean_return = np.nanmean(pair_returns, axis=0)
+        volatility = np.nanstd(pair_returns, axis=0, ddof=1)
+        turnover = 2 * np.nanmean(np.abs(np.diff(w, axis=0)), axis=0)
+        hit_rate = (pair_returns > 0).sum(axis=0) / (valid & (pair_returns != 0)).sum(axis=0)
+        sharpe = np.sqrt(252) * mean_return / volatility
+    return pd.DataFrame({'Stock1Index': i, 
+                         'Stock2Index': j,
+                         'Sharpe': sharpe,
+                         'AnnualizedReturn': mean_return * 252,
+                         'AnnualizedVolatility': volatility * np.sqrt(252),
+                         'Turnover': turnover,
+                         'HitRate': hit_rate,
+                         'NbrObservations': nbr_obs})
+
+
+class PairScanner(object):
+    # Runs the PairTradingPortfolio strategy over all N(N-1)/2 pairs of a 
+    # universe for one signal. Pairs are evaluated shard_size at a time, 
+    # optionally spread over a process pool, and come back ranked by Sharpe.
+
+    def __init__(self, stock_obj_arr, signal_func, relative_method='differencing',
+                 window=90, flip_signal=False):
+        self.stock_obj_arr = load_stock_arr(stock_obj_arr, prefetch=signal_prefetch([signal_func]))
+        self.signal_func = signal_func
+        self.relative_method = relative_method
+        self.window = window
+        self.flip_signal = flip_signal
+        self.tickers = [s.ticker for s in self.stock_obj_arr]
+        signal_dict = {}
+        returns_dict = {}
+        for stock_obj in self.stock_obj_arr:
+            signal_dict[stock_obj.ticker] = signal_func(stock_obj)
+            returns_dict[stock_obj.ticker] = stock_obj['PriceClose'].pct_change(1)
+        self.signal_df = pd.DataFrame(signal_dict)[self.tickers]
+        self.returns_df = pd.DataFrame(returns_dict)[self.tickers]
+        dts = self.signal_df.index.union(self.returns_df.index)
+        self.signal_df = self.signal_df.reindex(dts)
+        self.returns_df = self.returns_df.reindex(dts)
+        self.results_df = None
+
+    def pairs(self):
+        return np.array(list(combinations(range(len(self.tickers)), 2)), dtype=int).reshape(-1, 2)
+
+    def scan(self, max_workers=None, shard_size=2000):
+        # max_workers=None runs in process, otherwise shards go to a process pool
+        pairs = self.pairs()
+        shards = [pairs[k:k+shard_size] for k in range(0, len(pairs), shard_size)]
+        signal_arr = self.signal_df.values.astype(float)
+        returns_arr = self.returns_df.values.astype(float)
+        scan_kwargs = {'window': self.window, 
+                       'relative_method': self.relative_method,
+                       'flip_signal': self.flip_signal}
+        if max_workers is None:
+            results = [pair_scan_shard(shard, signal_arr=signal_arr, returns_arr=returns_arr,
+                                       **scan_kwargs) for shard in shards]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_pair_scan_worker,
+                                     initargs=(signal_arr, returns_arr)) as executor:
+                futures = [executor.submit(pair_scan_shard, shard, **scan_kwargs) for shard in shards]
+                results = [f.result() for f in futures]
+        
+        results_df = pd.concat(results, ignore_index=True) if results else pair_scan_shard(pairs, 
+                                       signal_arr=signal_arr, returns_arr=returns_arr, **scan_kwargs)
+        tickers = np.array(self.tickers, dtype=object)
+        results_df.insert(0, 'Stock1', tickers[results_df['Stock1Index'].values])
+        results_df.insert(1, 'Stock2', tickers[results_df['Stock2Index'].values])
+        results_df = results_df.drop(['Stock1Index', 'Stock2Index'], axis=1)
+        self.results_df = results_df.sort_values('Sharpe', ascending=False, na_position='last')\
+                                    .reset_index(drop=True)
+        return self.results_df
+        
+        
 class SingleSignalPortfolio(object):
 
     def __init__(self, stock_obj_arr, signal_func):
-        self.stock_obj_arr = stock_obj_arr
+        self.stock_obj_arr = load_stock_arr(stock_obj_arr, prefetch=signal_prefetch([signal_func]))
         self.signal_func = signal_func
         self.n_stocks = len(stock_obj_arr)
         self.signal_df = None
@@ -348,7 +646,7 @@ class SingleSignalPortfolio(object):
             stock_ticker = stock_obj.ticker
             signal_dict[stock_ticker] = stock_signal_ts
         self.signal_df = pd.DataFrame(signal_dict)
-        self.weight_df = self.signal_df.apply( lambda x: 2*((x.rank() - 1) / ( np.sum(~np.isnan(x)) - 1)) - 1, axis=1).fillna(0)
+        self.weight_df = Rank_Scale(self.signal_df).fillna(0)
         pass
     
     def get_returns(self):
@@ -358,56 +656,123 @@ class SingleSignalPortfolio(object):
     
 class SingleSignalHedgedPortfolio(object):
     
-    def __init__(self, stock_obj_arr, signal_func, hedge_signal_func, signal_return_view = 0.01, shrinkage_factor=0.85, portfolio_trgt_risk=0.2):
+    def __init__(self, stock_obj_arr, signal_func, hedge_signal_func=None, signal_return_view = 0.01, shrinkage_factor=0.85, portfolio_trgt_risk=0.2,
+                 hedge_signal_df=None, window=126):
+        # The hedge betas come either from hedge_signal_func per stock or as a
+        # ready (dates x tickers) hedge_signal_df, e.g. one factor of
+        # Fama_French_Rolling_Beta_Panel
+        if hedge_signal_func is None and hedge_signal_df is None:
+            raise ValueError('Need hedge_signal_func or hedge_signal_df')
         self.portfolio_trgt_risk = portfolio_trgt_risk
         self.shrinkage_factor = shrinkage_factor
-        self.stock_obj_arr = stock_obj_arr
+        self.window = window
+        self.stock_obj_arr = load_stock_arr(stock_obj_arr, 
+                                            prefetch=signal_prefetch([signal_func, hedge_signal_func]))
         self.signal_return_view = signal_return_view
         self.signal_func = signal_func
         self.hedge_signal_func = hedge_signal_func
         self.signal_df = stock_obj_arr_to_signal_mat(stock_obj_arr=self.stock_obj_arr , signal_func=self.signal_func)
-        self.hedge_signal_df = stock_obj_arr_to_signal_mat(stock_obj_arr=self.stock_obj_arr , signal_func=self.hedge_signal_func)
-        self.ranked_signal_df = self.signal_df.apply( lambda x: 2*((x.rank() - 1) / ( np.sum(~np.isnan(x)) - 1)) - 1, axis=1).fillna(0)
+        if hedge_signal_df is None:
+            hedge_signal_df = stock_obj_arr_to_signal_mat(stock_obj_arr=self.stock_obj_arr , signal_func=self.hedge_signal_func)
+        self.hedge_signal_df = hedge_signal_df
+        self.ranked_signal_df = Rank_Scale(self.signal_df).fillna(0)
         self.expected_returns_df = self.ranked_signal_df * self.signal_return_view
         self.returns_df = stock_obj_arr_to_return_mat(self.stock_obj_arr)
         self.returns_shifted_df = self.returns_df.shift(1)
-        self.var_covar_ts = return_mat_to_rolling_var_covar_dict(self.returns_df, 
-                                    window=126, 
+        self.var_covar_ts = return_mat_to_rolling_var_covar_cube(self.returns_df, 
+                                    window=self.window, 
                                     shrinkage_factor=self.shrinkage_factor)
-        self.inv_var_covar_ts = invert_var_covar_dict(var_covar_ts_dict=self.var_covar_ts)   
         self.weights = self.build_weights()
     
  
+    @timed
     def build_weights(self):
-        weights_dict = {}
         dts = self.hedge_signal_df.index.intersection(self.expected_returns_df.index)
-        for dt in dts:
-            if dt not in self.inv_var_covar_ts:
-                continue
-            
-            r = self.expected_returns_df.loc[dt,:]            
-            beta = self.hedge_signal_df.loc[dt,:] 
-            
-            Sig = self.var_covar_ts[dt]
-            Sig_inv = self.inv_var_covar_ts[dt]
-            
-            w = MVOpt_LS_Fixed_risk_beta(r=r, Sig=Sig, s=self.portfolio_trgt_risk, beta=beta, Sig_inv=Sig_inv)
-            weights_dict[dt] = w
-        weights_df = pd.DataFrame(weights_dict).T
-        return weights_df         
-        
-
-    
-        
-        
-        
-        
-    
+        dts = dts[dts.isin(self.var_covar_ts.dates)]
         
+        r = self.expected_returns_df.loc[dts, :].values
+        beta = self.hedge_signal_df.loc[dts, self.expected_returns_df.columns].values
+        Sig = self.var_covar_ts.values[self.var_covar_ts.dates.get_indexer(dts)]
         
+        w = MVOpt_LS_Fixed_risk_beta(r=r, Sig=Sig, s=self.portfolio_trgt_risk, beta=beta)
+        weights_df = pd.DataFrame(w, index=dts, columns=self.expected_returns_df.columns)
+        return weights_df
 
 
-
-
-
-
+class MeanVarianceSweep(object):
+    # MeanVarianceOptimization over a grid of windows x shrinkage factors x 
+    # risk targets. Prefix sums of the returns moments are built once for all
+    # windows, the raw var_covar stack of a window is shared by all shrinkage 
+    # factors, and as the weights scale with sqrt(s) they are only solved at
+    # s = 1 for every (window, shrinkage_factor) cell. Cells are independent
+    # and run on a thread pool, the batched solves release the GIL.
+    # expected_returns_df replaces the rolling mean returns, e.g. signal views.
+    # The var_covar prefix sums hold (T+1) x N x N floats, past max_prefix_sum_gb
+    # every window's var_covar is built with sliding sums instead.
+    # backtest_kwargs (linear_cost, quadratic_cost, ...) go to the Backtester.
+
+    def __init__(self, stock_arr, windows=[63, 126, 252], shrinkage_factors=[0.6, 0.8, 1.0],
+                 risk_targets=[0.1, 0.2, 0.35], expected_returns_df=None, 
+                 max_prefix_sum_gb=0.5, **backtest_kwargs):
+        self.stock_arr = load_stock_arr(stock_arr)
+        self.windows = list(windows)
+        self.shrinkage_factors = list(shrinkage_factors)
+        self.risk_targets = list(risk_targets)
+        self.expected_returns_df = expected_returns_df
+        self.backtest_kwargs = backtest_kwargs
+        self.returns_df = stock_obj_arr_to_return_mat(self.stock_arr)
+        self.tickers = self.returns_df.columns
+        T, N = self.returns_df.shape
+        self.moments = CumulativeMoments(self.returns_df.values, 
+                                         cumulative_var_covar=(T + 1) * N * N * 8 / 1e9 <= max_prefix_sum_gb)
+        self.raw_var_covar = {}
+        self.window_locks = {window: threading.Lock() for window in self.windows}
+        self.unit_weights = {}
+        self.results_df = None
+
+    def get_raw_var_covar(self, window):
+        # Annualized, unshrunk var_covar stack of a window, built once
+        with self.window_locks[window]:
+            if window not in self.raw_var_covar:
+                self.raw_var_covar[window] = self.moments.var_covar(window) * 252
+            return self.raw_var_covar[window]
+
+    @timed
+    def build_unit_weights(self, window, shrinkage_factor):
+        dts = self.returns_df.index[window:]
+        Sig = shrink_var_covar_arrays(self.get_raw_var_covar(window), shrinkage_factor)
+        if self.expected_returns_df is None:
+            r = self.moments.mean(window) * 252
+        else:
+            r = self.expected_returns_df.reindex(index=dts, columns=self.tickers).values
+        valid = ~np.isnan(r).any(axis=1)
+        w = MVOpt_LS_Fixed_risk(r = r[valid], Sig = Sig[valid], s = 1.0)
+        return pd.DataFrame(w, index=dts[valid], columns=self.tickers)
+
+    def weights_df(self, window, shrinkage_factor, s):
+        key = (window, shrinkage_factor)
+        if key not in self.unit_weights:
+            self.unit_weights[key] = self.build_unit_weights(window, shrinkage_factor)
+        return self.unit_weights[key] * np.sqrt(s)
+
+    def run_cell(self, window, shrinkage_factor):
+        data = []
+        for s in self.risk_targets:
+            summary = Backtester(self.weights_df(window, shrinkage_factor, s), self.returns_df,
+                                 **self.backtest_kwargs).summary()
+            data.append(dict({'Window': window,
+                              'ShrinkageFactor': shrinkage_factor,
+                              'RiskTarget': s}, **summary))
+        return data
+
+    def run(self, max_workers=None):
+        # max_workers=None runs the cells one after the other
+        cells = [(window, shrinkage_factor) for window in self.windows 
+                 for shrinkage_factor in self.shrinkage_factors]
+        if max_workers is None:
+            results = [self.run_cell(*cell) for cell in cells]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda cell: self.run_cell(*cell), cells))
+        self.results_df = pd.DataFrame([row for cell_rows in results for row in cell_rows])
+        return self.results_df
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:12:41 2026
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def rolling_var_covar_arrays(returns_arr, window=126):
+    # Sample (ddof=1) var_covar of rows i..i+window-1 for every i, stacked
+    # into a (T-window, N, N) array. Row i lines up with date i+window.
+    # Running sums of x and x x' are slid one row at a time, so each new
+    # window costs O(N^2) instead of O(window * N^2).
+    returns_arr = np.asarray(returns_arr, dtype=float)
+    T, N = returns_arr.shape
+    nbr_windows = max(T - window, 0)
+    var_covar_arr = np.empty((nbr_windows, N, N))
+    if nbr_windows == 0:
+        return var_covar_arr
+
+    # Covariance is shift invariant: centering first keeps the running sums
+    # small and avoids cancellation in S2 - S1 S1' / window
+    nan_mask = np.isnan(returns_arr)
+    X = returns_arr - np.nanmean(returns_arr, axis=0)
+    X[nan_mask] = 0.0
+
+    S1 = X[:window].sum(axis=0)
+    S2 = X[:window].T.dot(X[:window])
+    for i in range(nbr_windows):
+        var_covar_arr[i] = (S2 - np.outer(S1, S1) / window) / (window - 1)
+        if i + 1 < nbr_windows:
+            x_new, x_old = X[i + window], X[i]
+            S1 += x_new - x_old
+            S2 += np.outer(x_new, x_new) - np.outer(x_old, x_old)
+
+    _fill_nan_windows(var_covar_arr, returns_arr, nan_mask, window)
+    return var_covar_arr
+
+
+def _nan_windows(nan_mask, window):
+    # Indexes i of the windows i..i+window-1 that hold a missing value
+    nan_rows = np.concatenate([[0], np.cumsum(nan_mask.any(axis=1))])
+    return np.nonzero(nan_rows[window:-1] - nan_rows[:-window-1])[0]
+
+
+def _fill_nan_windows(var_covar_arr, returns_arr, nan_mask, window):
+    # Windows holding missing values fall back to pandas pairwise covariance
+    if nan_mask.any():
+        for i in _nan_windows(nan_mask, window):
+            var_covar_arr[i] = pd.DataFrame(returns_arr[i:i+window]).cov().values
+
+
+def shrink_var_covar_arrays(var_covar_arr, shrinkage_factor=0.8):
+    # Reduce the off_diagonal terms => cov but not var, for every date at once
+    diag_idx = np.arange(var_covar_arr.shape[-1])
+    shrunk_arr = var_covar_arr * shrinkage_factor
+    shrunk_arr[..., diag_idx, diag_idx] = var_covar_arr[..., diag_idx, diag_idx]
+    return shrunk_arr
+
+
+class CumulativeMoments(object):
+    # Prefix sums of x and x x' over the whole returns history. The sums over
+    # any window are the difference of two prefix sums, so the rolling means
+    # and var_covar stacks of several windows share one pass over the data.
+    # The x x' prefix sums are a (T+1, N, N) array; with cumulative_var_covar
+    # False they are not built and var_covar slides its sums window by window
+    # (rolling_var_covar_arrays) instead, for universes where they do not fit.
+
+    def __init__(self, returns_arr, cumulative_var_covar=True):
+        self.returns_arr = np.asarray(returns_arr, dtype=float)
+        T, N = self.returns_arr.shape
+        self.nan_mask = np.isnan(self.returns_arr)
+        # Centered as in rolling_var_covar_arrays
+        self.center = np.nanmean(self.returns_arr, axis=0)
+        X = self.returns_arr - self.center
+        X[self.nan_mask] = 0.0
+        self.S1 = np.zeros((T + 1, N))
+        np.cumsum(X, axis=0, out=self.S1[1:])
+        self.S2 = None
+        if cumulative_var_covar:
+            self.S2 = np.zeros((T + 1, N, N))
+            np.cumsum(np.einsum('ti,tj->tij', X, X), axis=0, out=self.S2[1:])
+
+    def _window_sums(self, S, window):
+        # Sums over rows i..i+window-1 for every i, lined up with date i+window
+        return S[window:-1] - S[:-window-1]
+
+    def mean(self, window=126):
+        mean_arr = self.center + self._window_sums(self.S1, window) / window
+        mean_arr[_nan_windows(self.nan_mask, window)] = np.nan
+        return mean_arr
+
+    def var_covar(self, window=126):
+        if self.S2 is None:
+            return rolling_var_covar_arrays(self.returns_arr, window=window)
+        S1 = self._window_sums(self.S1, window)
+        var_covar_arr = (self._window_sums(self.S2, window) - 
+                         np.einsum('ti,tj->tij', S1, S1) / window) / (window - 1)
+        _fill_nan_windows(var_covar_arr, self.returns_arr, self.nan_mask, window)
+        return var_covar_arr
+
+
+class MatrixCube(object):
+    # A stack of (n, m) matrices, one per date, held in one contiguous
+    # (T, n, m) array. Indexing by date returns a DataFrame view, so the cube
+    # can be used wherever a {date: DataFrame} dict was expected.
+
+    def __init__(self, values, dates, index, columns):
+        self._buffer = np.ascontiguousarray(values, dtype=float)
+        self._size = len(self._buffer)
+        self.dates = pd.Index(dates)
+        self.index = pd.Index(index)
+        self.columns = pd.Index(columns)
+        if self.values.shape != (len(self.dates), len(self.index), len(self.columns)):
+            raise ValueError('values must have shape (len(dates), len(index), len(columns))')
+
+    @property
+    def values(self):
+        return self._buffer[:self._size]
+
+    def append(self, dt, mat):
+        # Adds one date at the end. The buffer grows geometrically, so appending
+        # one day at a time does not copy the whole history every day
+        if self._size == len(self._buffer):
+            buffer = np.empty((max(2 * self._size, 1),) + self._buffer.shape[1:])
+            buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
+        self._buffer[self._size] = mat
+        self._size += 1
+        self.dates = self.dates.append(pd.Index([dt]))
+
+    def get_loc(self, dt):
+        return self.dates.get_loc(dt)
+
+    def __getitem__(self, dt):
+        return pd.DataFrame(self.values[self.get_loc(dt)], index=self.index,
+                            columns=self.columns, copy=False)
+
+    def __contains__(self, dt):
+        return dt in self.dates
+
+    def __iter__(self):
+        return iter(self.dates)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def keys(self):
+        return list(self.dates)
+
+    def items(self):
+        for dt in self.dates:
+            yield dt, self[dt]
+
+    def to_dict(self):
+        return {dt: mat for dt, mat in self.items()}
+
+
+class CovarianceCube(MatrixCube):
+    # MatrixCube of (N, N) var_covar matrices with tickers on both axes
+
+    def __init__(self, values, dates, tickers):
+        MatrixCube.__init__(self, values, dates, tickers, tickers)
+        self.tickers = self.index
+
+    @classmethod
+    def from_returns(cls, returns_mat, window=126, shrinkage_factor=0.8,
+                     annualization_factor=252):
+        var_covar_arr = rolling_var_covar_arrays(returns_mat.values, window=window)
+        var_covar_arr *= annualization_factor
+        if shrinkage_factor is not None:
+            var_covar_arr = shrink_var_covar_arrays(var_covar_arr, shrinkage_factor)
+        return cls(var_covar_arr, returns_mat.index[window:], returns_mat.columns)
+
+    def shrink(self, shrinkage_factor):
+        return CovarianceCube(shrink_var_covar_arrays(self.values, shrinkage_factor),
+                              self.dates, self.tickers)
+
+
+class DiagonalCovarianceCube(MatrixCube):
+    # CovarianceCube of diagonal matrices that only stores the (T, N)
+    # variances. Indexing by date returns the (N, N) DataFrame of that date,
+    # values builds the dense (T, N, N) stack on demand.
+
+    def __init__(self, variances, dates, tickers):
+        self._buffer = np.ascontiguousarray(variances, dtype=float)
+        self._size = len(self._buffer)
+        self.dates = pd.Index(dates)
+        self.index = pd.Index(tickers)
+        self.columns = self.index
+        self.tickers = self.index
+        if self.variances.shape != (len(self.dates), len(self.tickers)):
+            raise ValueError('variances must have shape (len(dates), len(tickers))')
+
+    @property
+    def variances(self):
+        return self._buffer[:self._size]
+
+    @property
+    def values(self):
+        variances = self.variances
+        values = np.zeros(variances.shape + variances.shape[-1:])
+        diag_idx = np.arange(variances.shape[-1])
+        values[:, diag_idx, diag_idx] = variances
+        return values
+
+    def append(self, dt, mat):
+        mat = np.asarray(mat, dtype=float)
+        MatrixCube.append(self, dt, np.diag(mat) if mat.ndim == 2 else mat)
+
+    def __getitem__(self, dt):
+        return pd.DataFrame(np.diag(self.variances[self.get_loc(dt)]), 
+                            index=self.index, columns=self.columns)
+
+    def to_frame(self):
+        # (dates x tickers) DataFrame of the variances
+        return pd.DataFrame(self.variances, index=self.dates, columns=self.tickers)
+
+
+class RollingVarCovar(object):
+    # Running sums of x and x x' over the last window rows of returns, for
+    # online updates: push a new row of returns and the oldest row drops out.
+    # Rows are centered on a fixed mean to keep the sums well conditioned.
+
+    def __init__(self, returns_arr, window=126):
+        returns_arr = np.asarray(returns_arr, dtype=float)[-window:]
+        if len(returns_arr) < window:
+            raise ValueError('Need at least window rows of returns')
+        self.window = window
+        self.center = returns_arr.mean(axis=0)
+        self.rows = returns_arr - self.center
+        self.position = 0
+        self.S1 = self.rows.sum(axis=0)
+        self.S2 = self.rows.T.dot(self.rows)
+
+    def push(self, returns_row):
+        x_new = np.asarray(returns_row, dtype=float) - self.center
+        if not np.isfinite(x_new).all():
+            raise ValueError('returns_row holds missing values')
+        x_old = self.rows[self.position]
+        self.S1 += x_new - x_old
+        self.S2 += np.outer(x_new, x_new) - np.outer(x_old, x_old)
+        self.rows[self.position] = x_new
+        self.position = (self.position + 1) % self.window
+
+    def mean(self):
+        return self.center + self.S1 / self.window
+
+    def var_covar(self):
+        return (self.S2 - np.outer(self.S1, self.S1) / self.window) / (self.window - 1)
+
+
+def cholesky_stack(var_covar_arr):
+    # Lower Cholesky factor of every (N, N) matrix in a (T, N, N) stack
+    if isinstance(var_covar_arr, CovarianceCube):
+        var_covar_arr = var_covar_arr.values
+    return np.linalg.cholesky(var_covar_arr)
+
+
+def cholesky_solve_stack(L_arr, B_arr, transpose=False):
+    # Solves L x = B (or L' x = B) for every date without forming L^-1.
+    # B is (T, N) or (T, N, m)
+    if transpose:
+        L_arr = np.swapaxes(L_arr, -1, -2)
+    if B_arr.ndim == 2:
+        return np.linalg.solve(L_arr, B_arr[..., None])[..., 0]
+    return np.linalg.solve(L_arr, B_arr)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:27:09 2026
+
+"""
+import pandas as pd
+
+
+class SignalPanel(object):
+    # Evaluates the per stock signals of Signals.py over a whole universe at once.
+    # The panel stands in for a Stock object: panel['Item'] is a (dates x tickers)
+    # DataFrame, so an expression such as stock_object['PriceClose'] / 
+    # stock_object['TotalRevenue'] runs once for every ticker. Fields are built
+    # once per panel and the ratio signals memoize themselves in signal_cache,
+    # so composite signals (e.g. SustainableGrowth_Signal) reuse their parts.
+
+    def __init__(self, stock_obj_arr):
+        self.stock_obj_arr = list(stock_obj_arr)
+        self.tickers = [s.ticker for s in self.stock_obj_arr]
+        self.field_cache = {}
+        self.signal_cache = {}
+
+    def __getitem__(self, item):
+        if item not in self.field_cache:
+            field_dict = {}
+            for s in self.stock_obj_arr:
+                try:
+                    field_dict[s.ticker] = s[item]
+                except KeyError:
+                    # Tickers without this field get an all NaN column
+                    field_dict[s.ticker] = pd.Series(dtype=float)
+            self.field_cache[item] = pd.DataFrame(field_dict)[self.tickers]
+        return self.field_cache[item]
+
+    def evaluate(self, signal_func):
+        # signal_func(panel) memoized for the life of the panel
+        if signal_func not in self.signal_cache:
+            self.signal_cache[signal_func] = signal_func(self)
+        return self.signal_cache[signal_func]
+
+    def signal_mat(self, signal_func):
+        # Same output as Portfolio.stock_obj_arr_to_signal_mat
+        return self.evaluate(signal_func).dropna()
+
+    def clear(self):
+        self.field_cache = {}
+        self.signal_cache = {}
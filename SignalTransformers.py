@@ -5,6 +5,19 @@ Created on Sat Feb 20 20:14:04 2021
 @author: saidsa
 """
 
-def Z_Score(signal_ts, window = 21):
-    return signal_ts.rolling(window = window).apply(lambda x: (x[-1] - x[0:-1].mean()) / x[0:-1].std())
- 
\ No newline at end of file
+def Z_Score(signal_ts, window = 21, min_periods = None, halflife = None):
+    # Z-score of every point against the window-1 points before it, the current
+    # point is left out of the mean and std. signal_ts can be a Series or a
+    # (dates x tickers) DataFrame, every column is handled at once.
+    # min_periods is the minimum number of observations in the window 
+    # (current point included), as in pandas rolling. With halflife set, 
+    # the mean and std of the past points are exponentially weighted instead.
+    if min_periods is None:
+        min_periods = window
+    if halflife is None:
+        past_signal = signal_ts.rolling(window = window - 1, min_periods = max(min_periods - 1, 1))
+    else:
+        past_signal = signal_ts.ewm(halflife = halflife, min_periods = max(min_periods - 1, 1))
+    past_mean = past_signal.mean().shift(1)
+    past_std = past_signal.std().shift(1)
+    return (signal_ts - past_mean) / past_std
@@ -5,32 +5,70 @@ Created on Sat Feb 13 13:55:33 2021
 @author: saidsa
 """
 
+import functools
 import numpy as np
 import pandas as pd
+from scipy.signal import lfilter
 from MacroData import get_Fama_French_ts
-from Utils import Rolling_Regression
+from Utils import Rolling_Regression_Batched
+from Utils import rolling_ols_arrays, rolling_window_sum
+
+def uses_data(*attributes):
+    # Records the lazily loaded Stock attributes a signal reads, so that
+    # portfolios can prefetch them when loading tickers (Portfolio.signal_prefetch).
+    # Signals without it are assumed to read everything.
+    def decorator(signal_func):
+        signal_func.data_attributes = attributes
+        return signal_func
+    return decorator
+
+# Anything read through stock[item] other than prices
+fundamental_data = ('zacks_earnings_cal', 'financial_data')
+
+def shared_signal(signal_func):
+    # Memoizes a ratio signal on objects that carry a signal_cache, such as
+    # SignalPanel, so composite signals compute their shared parts only once.
+    # Plain Stock objects are not affected.
+    @functools.wraps(signal_func)
+    def wrapper(stock_object):
+        signal_cache = getattr(stock_object, 'signal_cache', None)
+        if signal_cache is None:
+            return signal_func(stock_object)
+        if signal_func not in signal_cache:
+            signal_cache[signal_func] = signal_func(stock_object)
+        return signal_cache[signal_func]
+    # The shared signals are all ratios of the financial statements
+    wrapper.data_attributes = fundamental_data
+    return wrapper
 
 ######################### Valuation Ratios ###################################
+@shared_signal
 def Price_to_Sales_Signal (stock_object):
     return stock_object['PriceClose'] / (stock_object['TotalRevenue'] /stock_object['ShareIssued'])
     
 
+@shared_signal
 def Price_to_Earnings_Signal (stock_object):
     return stock_object['PriceClose'] / (stock_object['NetIncomeCommonStockholders'] /stock_object['ShareIssued'])
 
+@shared_signal
 def Price_to_CashFlow_Signal (stock_object):
     return stock_object['PriceClose'] / (stock_object['FreeCashFlow'] /stock_object['ShareIssued'])
 
+@shared_signal
 def Price_to_Book_Signal (stock_object):
     return stock_object['PriceClose'] / (stock_object['CommonStockEquity'] /stock_object['ShareIssued'])
 
+@shared_signal
 def DividendPayout_Ratio_Signal (stock_object):
     return stock_object['CashDividendsPaid'] / stock_object['NetIncomeCommonStockholders']
 
+@shared_signal
 def RetentionRate_Signal (stock_object):
     DP = DividendPayout_Ratio_Signal (stock_object)
     return 1 - DP
 
+@shared_signal
 def SustainableGrowth_Signal (stock_object):
     RR= RetentionRate_Signal(stock_object)
     ROE = ReturnOnEquity_Signal(stock_object)
@@ -41,44 +79,55 @@ def SustainableGrowth_Signal (stock_object):
 ########################## Activity Ratios ####################################
 
 
+@shared_signal
 def DaysInventoryOutstanding_Signal(stock_object):
     return (stock_object['Inventory'] + 0.5*stock_object['ChangeInInventory']) \
                     / ( stock_object['CostOfRevenue'] / 365.0)
 
+@shared_signal
 def DaysSalesOutstanding_Signal(stock_object):
     return (stock_object['AccountsReceivable'] + 0.5*stock_object['ChangesInAccountReceivables']) \
                     / ( stock_object['TotalRevenue'] / 365.0)
 
 
+@shared_signal
 def DaysPayableOutstanding_Signal(stock_object):
     return (stock_object['AccountsPayable'] + 0.5*stock_object['ChangeInAccountPayable']) \
                     / ( stock_object['CostOfRevenue'] / 365.0)
 
+@shared_signal
 def WorkingCapitalTurnover_Signal(stock_object):
     return stock_object['TotalRevenue'] / stock_object['WorkingCapital']
 
+@shared_signal
 def FixedAssetsTurnover_Signal(stock_object):
     return stock_object['TotalRevenue'] / (stock_object['TotalAssets'] - stock_object['GoodwillAndOtherIntangibleAssets'])
 
+@shared_signal
 def TotalAssetsTurnover_Signal(stock_object):
     return stock_object['TotalRevenue'] / stock_object['TotalAssets']
 
 
 ######################### Liquidity Ratios ###################################
+@shared_signal
 def Current_Ratio_Signal(stock_object):
     return stock_object['CurrentAssets'] / stock_object['CurrentLiabilities']
 
+@shared_signal
 def Quick_Ratio_Signal(stock_object):
     return (stock_object['CurrentAssets'] - stock_object['Inventory'])\
             / stock_object['CurrentLiabilities']
 
+@shared_signal
 def Cash_Ratio_Signal(stock_object):
     return stock_object['CashAndCashEquivalents'] / stock_object['CurrentLiabilities']
 
+@shared_signal
 def DefensiveInterval_Ratio_Signal(stock_object):
     return (stock_object['CashAndCashEquivalents'] + stock_object['Receivables']) \
             / stock_object['CurrentLiabilities']
 
+@shared_signal
 def CashConverstionCycle_Signal(stock_object):
     DIO = DaysInventoryOutstanding_Signal(stock_object)
     DSO = DaysSalesOutstanding_Signal(stock_object)
@@ -88,32 +137,41 @@ def CashConverstionCycle_Signal(stock_object):
 
 ######################## Profitability Ratios ##################################
 
+@shared_signal
 def GrossProfitMargin_Signal(stock_object):
     return stock_object['GrossProfit'] / stock_object['TotalRevenue']
 
+@shared_signal
 def OperatingProfitMargin_Signal(stock_object):
     return stock_object['OperatingIncome'] / stock_object['TotalRevenue']
 
+@shared_signal
 def PreTaxMargin_Signal(stock_object):
     return (stock_object['EBIT'] - stock_object['InterestExpense']) / stock_object['TotalRevenue']
 
+@shared_signal
 def NetIncomeMargin_Signal(stock_object):
     return stock_object['NetIncome'] / stock_object['TotalRevenue']
 
 
+@shared_signal
 def ReturnOnAssets_Signal(stock_object):
     return stock_object['NetIncome'] / stock_object['TotalAssets']
 
+@shared_signal
 def OperatingReturnOnAssets_Signal(stock_object):
     return stock_object['OperatingIncome'] / stock_object['TotalAssets']
 
 
+@shared_signal
 def ReturnOnEquity_Signal(stock_object):
     return stock_object['NetIncome'] / stock_object['TotalEquityGrossMinorityInterest']
 
+@shared_signal
 def OperatingReturnOnEquity_Signal(stock_object):
     return stock_object['OperatingIncome'] / stock_object['TotalEquityGrossMinorityInterest']
 
+@shared_signal
 def ReturnOnCommonEquity_Signal(stock_object):
     return stock_object['DilutedNIAvailtoComStockholders'] / stock_object['CommonStockEquity']
 
@@ -121,22 +179,28 @@ def ReturnOnCommonEquity_Signal(stock_object):
 
 ######################### Solvency Ratios ###################################
 
+@shared_signal
 def Debt_to_Assets_Signal(stock_object):
     return stock_object['TotalDebt'] / stock_object['TotalAssets']
 
 
+@shared_signal
 def Debt_to_Capital_Signal(stock_object):
     return stock_object['TotalDebt'] / ( stock_object['TotalDebt'] + stock_object['TotalEquityGrossMinorityInterest'] )
 
+@shared_signal
 def Debt_to_Equity_Signal(stock_object):
     return stock_object['TotalDebt'] / stock_object['TotalEquityGrossMinorityInterest']
 
+@shared_signal
 def FinancialLeverage_Signal(stock_object):
     return stock_object['TotalAssets'] / stock_object['TotalEquityGrossMinorityInterest']
 
+@shared_signal
 def InterestCoverage_Signal(stock_object):
     return stock_object['EBIT'] / stock_object['InterestExpense']
 
+@shared_signal
 def FixedCharge_Signal(stock_object):
     return ( stock_object['EBIT'] + stock_object['Leases'] ) / \
                  ( stock_object['InterestExpense'] + stock_object['Leases'] )
@@ -144,18 +208,33 @@ def FixedCharge_Signal(stock_object):
 
 ########################### Insider Flow #####################################
 
+def _insider_flow_kernel(window, hl):
+    # Weight of the net flow i days ago, i = 0..window-1, decaying with half life
+    # hl and scaled so that the weights sum up to window
+    raw_weights = np.array([(0.5**(1/hl))**i for i in range(window)])
+    return window * (raw_weights / sum(raw_weights))
+
+def _insider_net_value_df(insider_trade_df):
+    # Signed trade values, buys positive and sales negative, without touching
+    # the source frame
+    sign = insider_trade_df['Transaction'].map({'Sale': -1, 'Buy': 1}).fillna(0)
+    return pd.DataFrame({'Datetime': pd.to_datetime(insider_trade_df['Date']).values,
+                         'NetValue': (insider_trade_df['Value'] * sign).values})
+
+def _decayed_flow(daily_net_value_arr, window, hl):
+    # Decayed sum of the last window days for every day, as one FIR filter
+    # along the date axis. Days without a full window are NaN.
+    flow_arr = lfilter(_insider_flow_kernel(window, hl), [1.0], daily_net_value_arr, axis=0)
+    flow_arr[:window-1] = np.nan
+    return flow_arr
+
+@uses_data('insider_trading_data', *fundamental_data)
 def Insider_Flow_Signal(stock_obj, window=90, hl = 45):
-    insider_trade_df = stock_obj.insider_trading_data
-    insider_trade_df['Sign'] = insider_trade_df['Transaction'].apply( lambda x: -1 if x == 'Sale' else 1 if x == 'Buy' else 0 )
-    insider_trade_df['NetValue'] = insider_trade_df['Value'] * insider_trade_df['Sign']
-    insider_trade_df['Datetime'] = pd.to_datetime(insider_trade_df['Date'])
-    
-    raw_weights= np.array([(0.5**(1/hl))**i  for i in range(window-1,-1,-1)])
-    scaled_weights =  window * (raw_weights / sum(raw_weights))
-    net_value_ts = insider_trade_df.set_index('Datetime')\
-                                .loc[:, 'NetValue'].resample('D')\
-                                .sum().rolling(window=window)\
-                                .apply(lambda x: sum(x * scaled_weights))
+    net_value_df = _insider_net_value_df(stock_obj.insider_trading_data)
+    daily_net_value_ts = net_value_df.set_index('Datetime')\
+                                     .loc[:, 'NetValue'].resample('D').sum()
+    net_value_ts = pd.Series(_decayed_flow(daily_net_value_ts.values.astype(float), window, hl),
+                             index=daily_net_value_ts.index)
                                 
     net_value_ts.index = net_value_ts.index.map(lambda x: x.date())
     mkt_value_ts = stock_obj['ShareIssued']*stock_obj['PriceClose']
@@ -163,8 +242,44 @@ def Insider_Flow_Signal(stock_obj, window=90, hl = 45):
     signal_ts = signal_ts.loc[stock_obj['PriceClose'].index] 
     return signal_ts
 
+def Insider_Flow_Panel(stock_obj_arr, window=90, hl = 45):
+    # Insider_Flow_Signal for a whole universe: the trades of all tickers are
+    # stacked in one long frame, pivoted to (dates x tickers) daily net flows
+    # and filtered in a single pass. Returns a (dates x tickers) DataFrame.
+    tickers = [s.ticker for s in stock_obj_arr]
+    net_value_df_arr = [_insider_net_value_df(s.insider_trading_data).assign(Ticker=s.ticker)
+                        for s in stock_obj_arr 
+                        if s.insider_trading_data is not None and len(s.insider_trading_data) > 0]
+    if len(net_value_df_arr) == 0:
+        # No insider trades anywhere in the universe (e.g. a price only
+        # universe, or every Finviz load failed)
+        price_df = pd.DataFrame({s.ticker: s['PriceClose'] for s in stock_obj_arr})
+        return pd.DataFrame(np.nan, index=price_df.index, columns=tickers)
+    long_df = pd.concat(net_value_df_arr)
+    daily_net_value_df = long_df.pivot_table(index='Datetime', columns='Ticker', 
+                                             values='NetValue', aggfunc='sum')
+    daily_idx = pd.date_range(daily_net_value_df.index.min(), daily_net_value_df.index.max())
+    daily_net_value_df = daily_net_value_df.reindex(index=daily_idx, columns=tickers)
+    
+    # As for a single stock, every ticker's flow only spans its own first to
+    # last trade date
+    first_dt = long_df.groupby('Ticker')['Datetime'].min().reindex(tickers)
+    last_dt = long_df.groupby('Ticker')['Datetime'].max().reindex(tickers)
+    flow_arr = lfilter(_insider_flow_kernel(window, hl), [1.0], 
+                       daily_net_value_df.fillna(0).values, axis=0)
+    days_arr = daily_idx.values[:, None]
+    valid = (days_arr >= (first_dt + pd.Timedelta(days=window-1)).values[None, :]) \
+            & (days_arr <= last_dt.values[None, :])
+    net_value_df = pd.DataFrame(np.where(valid, flow_arr, np.nan), 
+                                index=daily_idx.map(lambda x: x.date()), columns=tickers)
+    
+    mkt_value_df = pd.DataFrame({s.ticker: s['ShareIssued']*s['PriceClose'] for s in stock_obj_arr})
+    signal_df = net_value_df.reindex(mkt_value_df.index) / mkt_value_df[tickers]
+    return signal_df
+
 ########################### Price Target ##################################### 
 
+@uses_data('ratings_data')
 def Price_target_to_Price_Signal(stock_obj):
     ratings_df = stock_obj.ratings_data
     ratings_df['DateTime'] =  pd.to_datetime(ratings_df['RatingDate'])
@@ -176,22 +291,56 @@ def Price_target_to_Price_Signal(stock_obj):
     
 ########################### Fama French Factors ############################### 
 
+@uses_data()
 def Fama_French_Rolling_Beta(stock_obj, Fama_French_Series_Name, window = 42):
     
     stock_daily_returns = stock_obj['PriceClose'].pct_change(1).dropna()
     F_F_series = get_Fama_French_ts(Fama_French_Series_Name)
-    output_dict = Rolling_Regression( Y_ts=stock_daily_returns, 
-                                     X_ts_arr=[F_F_series], 
-                                     window=window)
-    signal_dict = {dt: v['Beta_hat'][Fama_French_Series_Name] for dt, v in output_dict.items()}
+    output_dict = Rolling_Regression_Batched( Y_ts=stock_daily_returns, 
+                                             X_ts_arr=[F_F_series], 
+                                             window=window)
     
-    signal_ts = pd.Series(signal_dict)
+    signal_ts = output_dict['Beta_hat'][Fama_French_Series_Name]
     signal_ts.name = Fama_French_Series_Name + '_Beta'
     return signal_ts
        
     
+def Fama_French_Rolling_Beta_Panel(stock_obj_arr, Fama_French_Series_Names=['Mkt-RF', 'SMB', 'HML'], 
+                                   window = 42, dataset='3_Factors'):
+    # Rolling regression of every stock against all the Fama French series at
+    # once: the factors are shared, so each window solves one system for the
+    # whole universe. Returns ({factor: (dates x tickers) beta DataFrame},
+    # (dates x tickers) residual volatility DataFrame).
+    # Windows are taken on the dates with factor data and at least one stock
+    # return; a stock gets NaN for every window where its return is missing.
+    returns_df = pd.DataFrame({obj.ticker: obj['PriceClose'].pct_change(1).dropna() 
+                               for obj in stock_obj_arr})
+    F_F_df = pd.DataFrame({name: get_Fama_French_ts(name, dataset=dataset) 
+                           for name in Fama_French_Series_Names}).dropna()
+    dts = F_F_df.index.intersection(returns_df.dropna(how='all').index)
+    X = np.column_stack([F_F_df.loc[dts].values, np.ones(len(dts))])
+    Y = returns_df.loc[dts].values
+    
+    missing = np.isnan(Y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        output_arrays = rolling_ols_arrays(Y=np.where(missing, 0, Y), X=X, window=window)
+    incomplete = rolling_window_sum(missing, window) > 0
+    
+    output_dates = dts[window:]
+    beta_panel_dict = {}
+    for i, name in enumerate(Fama_French_Series_Names):
+        beta_arr = np.where(incomplete, np.nan, output_arrays['Beta_hat'][:, i, :])
+        beta_panel_dict[name] = pd.DataFrame(beta_arr, index=output_dates, 
+                                             columns=returns_df.columns)
+    residual_vol_arr = np.where(incomplete, np.nan, output_arrays['Sigma_hat_square'] ** 0.5)
+    residual_vol_df = pd.DataFrame(residual_vol_arr, index=output_dates, 
+                                   columns=returns_df.columns)
+    return beta_panel_dict, residual_vol_df
+       
+    
 ############################## Momentum Factors ################################## 
 
+@uses_data()
 def Momentum_dual_window(stock_obj, window_long, window_short):
     
     stock_daily_returns = stock_obj['PriceClose'].pct_change(1).dropna()
@@ -201,9 +350,11 @@ def Momentum_dual_window(stock_obj, window_long, window_short):
     return Momentum_window_long_series - Momentum_window_short_series
 
 
+@uses_data()
 def Momentum_12M_1M(stock_obj):
     return Momentum_dual_window(stock_obj, window_long = 252, window_short = 21)
 
+@uses_data()
 def Momentum_window(stock_obj, window):
     
     stock_daily_returns = stock_obj['PriceClose'].pct_change(1).dropna()
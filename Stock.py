@@ -6,6 +6,12 @@ Created on Sat Jan  2 14:45:14 2021
 """
 
 import os
+import atexit
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
@@ -16,9 +22,11 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import Select
 import time
 from yahooquery import Ticker    
-from textblob import TextBlob
 from Utils import as_of_date_to_quarter
 from Utils import pandas_csv_cache
+from NewsSentiment import add_news_sentiment, score_new_headlines
+from DataSources import DataSource
+from Instrumentation import timed, timer
 
 if os.getenv("IKAROSDATA") is not None:
     library_folder = os.getenv("IKAROSDATA")
@@ -29,27 +37,198 @@ else:
 
 
 
+@functools.lru_cache(maxsize=None)
+def _chrome_driver_path():
+    return ChromeDriverManager().install()
+
+
+def launch_headless_chrome():
+    opts = Options()
+    opts.headless = True
+    return webdriver.Chrome(_chrome_driver_path(), options=opts)
+
+
+# Upper bound on concurrent requests to each data source when stocks are
+# loaded from several threads, see StockUniverse.load
+source_semaphores = {'yahoo': threading.BoundedSemaphore(8),
+                     'zacks': threading.BoundedSemaphore(2),
+                     'finviz': threading.BoundedSemaphore(2)}
+
+
+# Semaphores of the StockUniverse.load running on the current thread, if any
+_load_semaphores = threading.local()
+_active_loads = [0]
+_active_loads_lock = threading.Lock()
+
+
+def set_source_limits(**limits):
+    # Changes the default limits. Threads already waiting on a semaphore
+    # would no longer be limited by its replacement, so this is refused while
+    # a StockUniverse.load runs; pass source_limits to the load instead.
+    with _active_loads_lock:
+        if _active_loads[0] > 0:
+            raise RuntimeError('Cannot change source limits while a StockUniverse.load is running')
+        for source, limit in limits.items():
+            source_semaphores[source] = threading.BoundedSemaphore(limit)
+
+
+def make_source_semaphores(source_limits=None):
+    # Semaphores for one load: the defaults, with source_limits (e.g.
+    # {'finviz': 2}) replacing those of the sources it names
+    semaphores = dict(source_semaphores)
+    for source, limit in (source_limits or {}).items():
+        semaphores[source] = threading.BoundedSemaphore(limit)
+    return semaphores
+
+
+@contextmanager
+def using_source_semaphores(semaphores):
+    previous = getattr(_load_semaphores, 'semaphores', None)
+    _load_semaphores.semaphores = semaphores
+    try:
+        yield
+    finally:
+        _load_semaphores.semaphores = previous
+
+
+@contextmanager
+def source_limit(source):
+    semaphores = getattr(_load_semaphores, 'semaphores', None) or source_semaphores
+    with semaphores[source]:
+        yield
+
+
+class BrowserPool(object):
+    # Keeps up to max_size browser drivers alive and hands them out one caller
+    # at a time, so scrapers reuse a warm browser instead of launching one per
+    # page. driver_factory can be swapped for a fake driver in tests.
+
+    def __init__(self, max_size=2, driver_factory=launch_headless_chrome):
+        self.max_size = max_size
+        self.driver_factory = driver_factory
+        self._idle_drivers = queue.LifoQueue()
+        self._semaphore = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._drivers = []
+
+    @contextmanager
+    def driver(self):
+        self._semaphore.acquire()
+        try:
+            try:
+                driver = self._idle_drivers.get_nowait()
+            except queue.Empty:
+                driver = self.driver_factory()
+                with self._lock:
+                    self._drivers.append(driver)
+            try:
+                yield driver
+            except Exception:
+                # A failed page load can leave the browser in a bad state
+                self._discard(driver)
+                raise
+            self._idle_drivers.put(driver)
+        finally:
+            self._semaphore.release()
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle_drivers.get_nowait())
+            except queue.Empty:
+                break
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
+
+
+def fetch_page_source(url, wait_in_sec=1):
+    with browser_pool.driver() as driver:
+        driver.get(url)
+        time.sleep(wait_in_sec)
+        return driver.page_source
+
+
+class _PageCache(object):
+    # Short lived in-process store of downloaded pages, so the ratings, insider
+    # and news scrapers for one ticker share a single page load
+
+    def __init__(self, expiration_in_sec=10*60, max_pages=64):
+        self.expiration_in_sec = expiration_in_sec
+        self.max_pages = max_pages
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._url_locks = {}
+
+    def get(self, url):
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            with self._lock:
+                if url in self._pages:
+                    fetch_time, page_source = self._pages[url]
+                    if time.time() - fetch_time <= self.expiration_in_sec:
+                        return page_source
+            page_source = fetch_page_source(url)
+            with self._lock:
+                if len(self._pages) >= self.max_pages:
+                    oldest_url = min(self._pages, key=lambda u: self._pages[u][0])
+                    del self._pages[oldest_url]
+                self._pages[url] = (time.time(), page_source)
+            return page_source
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+finviz_page_cache = _PageCache()
+
+
+@timed
+def get_finviz_quote_soup(ticker):
+    url = 'https://finviz.com/quote.ashx?t={ticker}'.format(ticker=ticker)
+    return BeautifulSoup(finviz_page_cache.get(url), 'html.parser')
+
+
+def rows_since(df, column, last_timestamp):
+    # Rows of a freshly scraped table that are not older than the last row
+    # already cached, used for incremental cache refreshes
+    if last_timestamp is None or len(df) == 0:
+        return df
+    return df[pd.to_datetime(df[column]) >= pd.Timestamp(last_timestamp)]
+
+
+@timed
 @pandas_csv_cache(folder=os.path.join(library_folder, 'ZacksEarningsCalendar'),
                   file_template='{ticker}.csv',
                   expiration_in_sec=24*60*60*15,
                   read_csv_kwargs={'sep': '|',
                                    'parse_dates': [0]},
                   to_csv_kwargs={'index': False,
-                                 'sep': '|'})
+                                 'sep': '|'},
+                  storage_format='pickle',
+                  memory_cache_size=512)
 def get_zacks_earnings_calendar(ticker):
     
     url = 'https://www.zacks.com/stock/research/{ticker}/earnings-announcements'.format(ticker=ticker)
 
-    opts = Options()
-    opts.headless = True
-    
-    driver = webdriver.Chrome(ChromeDriverManager().install(), options=opts)
-    driver.get(url)
-    time.sleep(1)
-    select = Select(driver.find_element_by_name('earnings_announcements_earnings_table_length'))
-    select.select_by_visible_text('100')
-    soup = BeautifulSoup(driver.page_source, 'html.parser') 
-    driver.close()
+    with browser_pool.driver() as driver:
+        driver.get(url)
+        time.sleep(1)
+        select = Select(driver.find_element_by_name('earnings_announcements_earnings_table_length'))
+        select.select_by_visible_text('100')
+        soup = BeautifulSoup(driver.page_source, 'html.parser') 
     
     table = soup.find('table', id='earnings_announcements_earnings_table')
     table_body = table.find('tbody')
@@ -71,27 +250,24 @@ def get_zacks_earnings_calendar(ticker):
     return df
 
 
+@timed
 @pandas_csv_cache(folder=os.path.join(library_folder, 'FinvizFundamentalRatings'),
                   file_template='{ticker}.csv',
                   expiration_in_sec=24*60*60*15,
                   read_csv_kwargs={'sep': '|',
                                    'parse_dates': [0]},
                   to_csv_kwargs={'index': False,
-                                 'sep': '|'})
-def get_finviz_fundamentals_ratings(ticker):
-    
-    url = 'https://finviz.com/quote.ashx?t={ticker}'.format(ticker=ticker)
-    
-    opts = Options()     
-    opts.headless = True
-    
-    driver = webdriver.Chrome(ChromeDriverManager().install(), options=opts)
-    driver.get(url)
-    time.sleep(1)
-    soup = BeautifulSoup(driver.page_source, 'html.parser') 
-    driver.close()
-    
-    
+                                 'sep': '|'},
+                  storage_format='pickle',
+                  memory_cache_size=512,
+                  incremental_column='RatingDate',
+                  incremental_ascending=False)
+def get_finviz_fundamentals_ratings(ticker, cached_df=None, last_timestamp=None):
+    df = parse_finviz_fundamentals_ratings(get_finviz_quote_soup(ticker))
+    return rows_since(df, 'RatingDate', last_timestamp)
+
+
+def parse_finviz_fundamentals_ratings(soup):
     table = soup.find('table', attrs={'class':'fullview-ratings-outer'})
     table_body = table.find('tbody')
     
@@ -140,28 +316,25 @@ def get_finviz_fundamentals_ratings(ticker):
 
 
 
+@timed
 @pandas_csv_cache(folder=os.path.join(library_folder, 'FinvizInsiderTrading'),
                   file_template='{ticker}.csv',
                   expiration_in_sec=24*60*60*15,
                   read_csv_kwargs={'sep': '|',
                                    'parse_dates': [0]},
                   to_csv_kwargs={'index': False,
-                                 'sep': '|'})
-def get_finviz_inside_trading(ticker):
-    
+                                 'sep': '|'},
+                  storage_format='pickle',
+                  memory_cache_size=512,
+                  incremental_column='Date',
+                  incremental_ascending=False)
+def get_finviz_inside_trading(ticker, cached_df=None, last_timestamp=None):
+    df = parse_finviz_inside_trading(get_finviz_quote_soup(ticker))
+    return rows_since(df, 'Date', last_timestamp)
+
+
+def parse_finviz_inside_trading(soup):
     today = datetime.now().date()
-    url = 'https://finviz.com/quote.ashx?t={ticker}'.format(ticker=ticker)
-    
-    opts = Options()     
-    opts.headless = True
-    
-    driver = webdriver.Chrome(ChromeDriverManager().install(), options=opts)
-    driver.get(url)
-    time.sleep(1)
-    soup = BeautifulSoup(driver.page_source, 'html.parser') 
-    driver.close()
-    
-    
     table = soup.find('table', attrs={'class':'body-table', 'bgcolor':'#d3d3d3'})
     table_body = table.find('tbody')
     
@@ -200,27 +373,24 @@ def get_finviz_inside_trading(ticker):
     df = pd.DataFrame(data)
     return df
 
+@timed
 @pandas_csv_cache(folder=os.path.join(library_folder, 'FinvizNews'),
                   file_template='{ticker}.csv',
                   expiration_in_sec=24*60*60*1,
                   read_csv_kwargs={'sep': '|',
                                    'parse_dates': [0]},
                   to_csv_kwargs={'index': False,
-                                 'sep': '|'})
-def get_finviz_news(ticker):
-    
-    url = 'https://finviz.com/quote.ashx?t={ticker}'.format(ticker=ticker)
-    
-    opts = Options()     
-    opts.headless = True
-    
-    driver = webdriver.Chrome(ChromeDriverManager().install(), options=opts)
-    driver.get(url)
-    time.sleep(1)
-    soup = BeautifulSoup(driver.page_source, 'html.parser') 
-    driver.close()
-    
-    
+                                 'sep': '|'},
+                  storage_format='pickle',
+                  memory_cache_size=512,
+                  incremental_column='NewsDateTime',
+                  incremental_ascending=False)
+def get_finviz_news(ticker, cached_df=None, last_timestamp=None):
+    df = parse_finviz_news(get_finviz_quote_soup(ticker))
+    return rows_since(df, 'NewsDateTime', last_timestamp)
+
+
+def parse_finviz_news(soup):
     table = soup.find('table', id='news-table')
     table_body = table.find('tbody')
     
@@ -250,9 +420,7 @@ def get_finviz_news(ticker):
             'NewsDateTime': News_Date_Time,
             'NewsHeadlines': News_headlines,
             'Newslink': News_link,
-            'NewsPublication': News_publication,
-            'NewsSentiment': TextBlob(News_headlines).sentiment.polarity ,
-            'NewsSubjectivity': TextBlob(News_headlines).sentiment.subjectivity
+            'NewsPublication': News_publication
             })
         
     df = pd.DataFrame(data)
@@ -260,40 +428,170 @@ def get_finviz_news(ticker):
 
 
 
+def parse_finviz_quote_tables(soup):
+    return {'ratings_data': parse_finviz_fundamentals_ratings(soup),
+            'insider_trading_data': parse_finviz_inside_trading(soup),
+            'news_data': parse_finviz_news(soup)}
+
+
+def get_finviz_quote_data(ticker):
+    # The three Finviz tables live on the same quote page: every cache is
+    # still populated separately, but the page is only downloaded once
+    return {'ratings_data': get_finviz_fundamentals_ratings(ticker),
+            'insider_trading_data': get_finviz_inside_trading(ticker),
+            'news_data': get_finviz_news(ticker)}
+
+
+
+class LiveDataSource(DataSource):
+    # yahooquery for prices and fundamentals, Zacks and Finviz scrapers for
+    # the rest, each call held to its source limit
+
+    @timed
+    def get_price_history(self, ticker):
+        with source_limit('yahoo'):
+            df = Ticker(ticker).history(adj_ohlc=True,  
+                                     start=(datetime.today() \
+                                            -timedelta(days = 365*3)
+                                            ).strftime('%Y-%m-%d'), 
+                                     end = datetime.today().strftime('%Y-%m-%d')
+                                     )
+        return df.droplevel(0).rename(columns={'high': 'PriceHigh',
+                                               'volume': 'Volume',
+                                               'open': 'PriceOpen',
+                                               'low': 'PriceLow',
+                                               'close': 'PriceClose' 
+                                               })
+
+    @timed
+    def get_financial_data(self, ticker, fundamental_frequency='q'):
+        with source_limit('yahoo'):
+            return Ticker(ticker).all_financial_data( frequency = fundamental_frequency)
+
+    @timed
+    def get_earnings_calendar(self, ticker):
+        with source_limit('zacks'):
+            return get_zacks_earnings_calendar(ticker)
+
+    @timed
+    def get_ratings(self, ticker):
+        with source_limit('finviz'):
+            return get_finviz_fundamentals_ratings(ticker)
+
+    @timed
+    def get_insider_trades(self, ticker):
+        with source_limit('finviz'):
+            return get_finviz_inside_trading(ticker)
+
+    @timed
+    def get_news(self, ticker):
+        with source_limit('finviz'):
+            return get_finviz_news(ticker)
+
+
+live_data_source = LiveDataSource()
+
+
+class lazy_attribute(object):
+    # Stock attribute fetched through loader(stock) on first access and then
+    # memoized on the instance. Assigning the attribute replaces the value.
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.name = loader.__name__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            obj.__dict__[self.name] = self.loader(obj)
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
 class Stock(object):
+    # Only the price history is fetched up front. zacks_earnings_cal,
+    # financial_data and the Finviz tables are fetched on first use and kept,
+    # so a price only universe never starts a browser; prefetch() loads them
+    # all at once.
     
-    def __init__(self, ticker, fundamental_frequency='q'):
+    lazy_attributes = ['zacks_earnings_cal', 'financial_data', 'ratings_data',
+                       'insider_trading_data', 'news_data']
+    # Read by stock[item] for anything that is not a price column
+    fundamental_attributes = ['zacks_earnings_cal', 'financial_data']
+
+    @timed
+    def __init__(self, ticker, fundamental_frequency='q', score_news=True, data_source=None):
+        # data_source defaults to the live sites, a DataSources.ReplayDataSource
+        # builds the same object from disk
         self.ticker= ticker
-        self.zacks_earnings_cal = get_zacks_earnings_calendar(ticker)
-        self.yquery = Ticker(ticker)
-        self.returns_data = self.yquery.history(adj_ohlc=True,  
-                                 start=(datetime.today() \
-                                        -timedelta(days = 365*3)
-                                        ).strftime('%Y-%m-%d'), 
-                                 end = datetime.today().strftime('%Y-%m-%d')
-                                 ).droplevel(0).rename(columns={'high': 'PriceHigh',
-                                                                'volume': 'Volume',
-                                                                'open': 'PriceOpen',
-                                                                'low': 'PriceLow',
-                                                                'close': 'PriceClose' 
-                                                                })
-        self.financial_data = self.get_all_financial_data(fundamental_frequency=fundamental_frequency)
-        try:
-            self.ratings_data = get_finviz_fundamentals_ratings(ticker)
-        except:
-            self.ratings_data = None
-        try:
-            self.insider_trading_data = get_finviz_inside_trading(ticker)
-        except:
-            self.insider_trading_data = None
+        self.data_source = live_data_source if data_source is None else data_source
+        self.fundamental_frequency = fundamental_frequency
+        self.score_news_on_load = score_news
+        # Failures of the lazily fetched sources, {attribute name: exception}
+        self.load_errors = {}
+        self.returns_data = self.data_source.get_price_history(ticker)
+
+    def _load(self, attribute, fetcher, required=False):
+        # The optional Finviz tables come back as None when their source fails,
+        # the earnings calendar and financial data raise. Either way the error
+        # is kept in load_errors.
         try:
-            self.news_data = get_finviz_news(ticker)
-        except:
-            self.news_data = None
+            with timer('Stock.load.' + attribute):
+                value = fetcher()
+        except Exception as e:
+            self.load_errors[attribute] = e
+            if required:
+                raise
+            return None
+        self.load_errors.pop(attribute, None)
+        return value
+
+    @lazy_attribute
+    def zacks_earnings_cal(self):
+        return self._load('zacks_earnings_cal', 
+                          lambda: self.data_source.get_earnings_calendar(self.ticker),
+                          required=True)
+
+    @lazy_attribute
+    def ratings_data(self):
+        return self._load('ratings_data', lambda: self.data_source.get_ratings(self.ticker))
+
+    @lazy_attribute
+    def insider_trading_data(self):
+        return self._load('insider_trading_data', 
+                          lambda: self.data_source.get_insider_trades(self.ticker))
+
+    @lazy_attribute
+    def news_data(self):
+        news_df = self._load('news_data', lambda: self.data_source.get_news(self.ticker))
+        # Headline sentiment is scored after scraping, from the shared store
+        if news_df is not None and self.score_news_on_load:
+            news_df = add_news_sentiment(news_df)
+        return news_df
+
+    def prefetch(self, attributes=None):
+        # Fetches the lazy attributes now, e.g. from a loader thread. Errors of
+        # the required sources are left in load_errors rather than raised.
+        for attribute in (self.lazy_attributes if attributes is None else attributes):
+            try:
+                getattr(self, attribute)
+            except Exception:
+                pass
+        return self
+
+    def score_news(self, max_workers=None):
+        if self.news_data is not None:
+            self.news_data = add_news_sentiment(self.news_data, max_workers=max_workers)
             
             
     def get_all_financial_data (self, fundamental_frequency='q'):
-        df = self.yquery.all_financial_data( frequency = fundamental_frequency)
+        df = self.data_source.get_financial_data(self.ticker, fundamental_frequency=fundamental_frequency)
         df['Quarter'] = df['asOfDate'].apply(lambda x: as_of_date_to_quarter(x))
         df = pd.merge(df, self.zacks_earnings_cal, how = 'left', on = 'Quarter')\
             .set_index('ReleaseDate').drop(['asOfDate', 'periodType', 'Quarter'], axis = 1)
@@ -301,12 +599,41 @@ class Stock(object):
         
         
         
+    # Assigning new returns_data or financial_data drops the cached
+    # fundamental panel, it is rebuilt on the next fundamental lookup
+    @property
+    def returns_data(self):
+        return self._returns_data
+
+    @returns_data.setter
+    def returns_data(self, returns_data):
+        self._returns_data = returns_data
+        self._fundamental_panel = None
+
+    @property
+    def financial_data(self):
+        if '_financial_data' not in self.__dict__:
+            self.financial_data = self._load('financial_data', 
+                lambda: self.get_all_financial_data(fundamental_frequency=self.fundamental_frequency),
+                required=True)
+        return self._financial_data
+
+    @financial_data.setter
+    def financial_data(self, financial_data):
+        self._financial_data = financial_data
+        self._fundamental_panel = None
+
+    def get_fundamental_panel (self):
+        # Point in time fundamentals for every column, aligned on the daily
+        # returns index. Built once, then every fundamental lookup is a column view
+        if self._fundamental_panel is None:
+            date_idx = pd.date_range(self.returns_data.index[0], self.returns_data.index[-1])
+            panel = self.financial_data.reindex(index = date_idx).shift(1).ffill()
+            self._fundamental_panel = panel.loc[self.returns_data.index]
+        return self._fundamental_panel
+        
     def get_fundamental_ts (self, item):
-        ts = self.financial_data[item]
-        date_idx = pd.date_range(self.returns_data.index[0], self.returns_data.index[-1])
-        ts = ts.reindex(index = date_idx).shift(1).ffill()
-        ts = ts.loc[self.returns_data.index]
-        return ts
+        return self.get_fundamental_panel()[item]
         
     def __getitem__(self, item):
         if item in self.returns_data.columns:
@@ -322,4 +649,104 @@ class Stock(object):
         
         
         
-        
\ No newline at end of file
+        
+
+
+class StockUniverse(object):
+    # A set of Stock objects loaded together. failures maps each ticker that
+    # did not load cleanly to {source: exception}; a ticker whose Stock could
+    # not be built at all is reported under the 'Stock' source and left out
+    # of stocks.
+
+    def __init__(self, stocks, failures):
+        self.stocks = stocks
+        self.failures = failures
+
+    @classmethod
+    def load(cls, tickers, max_workers=8, source_limits=None, 
+             fundamental_frequency='q', raise_errors=False, sentiment_workers=None,
+             data_source=None, prefetch=True):
+        # Stock loading is I/O bound, so tickers are fanned out over a thread
+        # pool while source_limits (e.g. {'finviz': 2}) caps each data source.
+        # The limits hold for this load only, sources it does not name keep
+        # the default limits shared by all loads.
+        # With prefetch, every lazy attribute is fetched in the pool and news
+        # sentiment is then scored for the whole universe in one batch, over
+        # sentiment_workers processes. prefetch=False only loads prices, and a
+        # list of lazy attribute names prefetches only those.
+        semaphores = make_source_semaphores(source_limits)
+        tickers = list(dict.fromkeys(tickers))
+        if prefetch is True:
+            prefetch_attributes = list(Stock.lazy_attributes)
+        else:
+            prefetch_attributes = list(prefetch or [])
+        batch_score_news = 'news_data' in prefetch_attributes
+
+        def load_stock(ticker):
+            try:
+                with using_source_semaphores(semaphores):
+                    stock_obj = Stock(ticker, fundamental_frequency=fundamental_frequency,
+                                      score_news=not batch_score_news, data_source=data_source)
+                    if prefetch_attributes:
+                        stock_obj.prefetch(prefetch_attributes)
+                return stock_obj, None
+            except Exception as e:
+                return None, e
+
+        with _active_loads_lock:
+            _active_loads[0] += 1
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(load_stock, tickers))
+        finally:
+            with _active_loads_lock:
+                _active_loads[0] -= 1
+
+        if batch_score_news:
+            loaded = [stock_obj for stock_obj, _ in results if stock_obj is not None]
+            score_new_headlines([h for stock_obj in loaded if stock_obj.news_data is not None
+                                 for h in stock_obj.news_data['NewsHeadlines'].astype(str)],
+                                max_workers=sentiment_workers)
+            for stock_obj in loaded:
+                stock_obj.score_news()
+                stock_obj.score_news_on_load = True
+
+        stocks = {}
+        failures = {}
+        for ticker, (stock_obj, error) in zip(tickers, results):
+            if error is not None:
+                if raise_errors:
+                    raise error
+                failures[ticker] = {'Stock': error}
+                continue
+            stocks[ticker] = stock_obj
+            if stock_obj.load_errors:
+                failures[ticker] = dict(stock_obj.load_errors)
+        return cls(stocks, failures)
+
+    @property
+    def tickers(self):
+        return list(self.stocks.keys())
+
+    def failure_report(self):
+        # Includes the failures of attributes fetched lazily after load
+        failures = dict(self.failures)
+        for ticker, stock_obj in self.stocks.items():
+            if stock_obj.load_errors:
+                failures[ticker] = dict(stock_obj.load_errors)
+        data = []
+        for ticker, errors in failures.items():
+            for source, error in errors.items():
+                data.append({'Ticker': ticker,
+                             'Source': source,
+                             'Error': repr(error)})
+        return pd.DataFrame(data, columns=['Ticker', 'Source', 'Error'])
+
+    def __getitem__(self, ticker):
+        return self.stocks[ticker]
+
+    def __iter__(self):
+        return iter(self.stocks.values())
+
+    def __len__(self):
+        return len(self.stocks)
@@ -4,10 +4,15 @@ Created on Thu Mar 11 15:02:32 2021
 
 """
 from numpy.linalg import inv
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
 import pandas as pd
 import functools
 import os
+import threading
 import time
+from collections import OrderedDict
+from Instrumentation import profiler, timed
 
 def OLS_regression(X,Y, add_constant = True):
     
@@ -46,8 +51,120 @@ def as_of_date_to_quarter (dt):
     Q = int((int(month) - 0.01)/ 3) + 1
     return str(Q)+'Q'+ str(year)
 
+_storage_extensions = {'csv': '.csv', 'pickle': '.pkl', 'parquet': '.parquet'}
+
+
+def _read_frame(file_path, storage_format, read_csv_kwargs):
+    if storage_format == 'csv':
+        return pd.read_csv(file_path, **read_csv_kwargs)
+    elif storage_format == 'pickle':
+        return pd.read_pickle(file_path)
+    elif storage_format == 'parquet':
+        return pd.read_parquet(file_path)
+    raise ValueError('Unknown storage_format: ' + str(storage_format))
+
+
+def _write_frame(df, file_path, storage_format, to_csv_kwargs):
+    if storage_format == 'csv':
+        df.to_csv(file_path, **to_csv_kwargs)
+    elif storage_format == 'pickle':
+        df.to_pickle(file_path)
+    elif storage_format == 'parquet':
+        df.to_parquet(file_path)
+    else:
+        raise ValueError('Unknown storage_format: ' + str(storage_format))
+
+
+class _FrameLRU(object):
+    # In-process layer in front of the on-disk cache, holds at most maxsize
+    # frames keyed by file path along with the time they were written
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, expiration_in_sec):
+        with self._lock:
+            if key not in self._frames:
+                return None
+            write_time, df = self._frames[key]
+            if time.time() - write_time > expiration_in_sec:
+                del self._frames[key]
+                return None
+            self._frames.move_to_end(key)
+            return df.copy()
+
+    def put(self, key, write_time, df):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._frames[key] = (write_time, df.copy())
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.maxsize:
+                self._frames.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+
+def _last_timestamp(df, incremental_column):
+    if len(df) == 0:
+        return None
+    if incremental_column == 'index':
+        return df.index.max()
+    return df[incremental_column].max()
+
+
+def _merge_increment(cached_df, new_df, incremental_column, ascending=True):
+    # The incremental column is made datetime64 on both frames first: a cache
+    # migrated from csv holds Timestamps where the parsers return dates, and
+    # those would neither dedupe nor sort against each other. Rows are
+    # deduplicated on the columns the fetcher returns, so columns only found
+    # in an older cache (e.g. NewsSentiment) do not keep overlapping rows apart.
+    # The merged frame keeps the source ordering: oldest first when ascending,
+    # newest first otherwise, new rows ahead of cached ones on the same
+    # timestamp.
+    if incremental_column == 'index':
+        cached_df = cached_df.set_axis(pd.to_datetime(cached_df.index), axis=0)
+        new_df = new_df.set_axis(pd.to_datetime(new_df.index), axis=0)
+        df = pd.concat([cached_df, new_df])
+        df = df[~df.index.duplicated(keep='last')].sort_index(ascending=ascending, kind='mergesort')
+    else:
+        cached_df = cached_df.assign(**{incremental_column: pd.to_datetime(cached_df[incremental_column])})
+        new_df = new_df.assign(**{incremental_column: pd.to_datetime(new_df[incremental_column])})
+        key_columns = [c for c in new_df.columns if c in cached_df.columns]
+        if ascending:
+            df = pd.concat([cached_df, new_df]).drop_duplicates(subset=key_columns, keep='last')
+        else:
+            df = pd.concat([new_df, cached_df]).drop_duplicates(subset=key_columns, keep='first')
+        df = df.sort_values(incremental_column, ascending=ascending, kind='mergesort')\
+               .reset_index(drop=True)
+    return df
+
+
 def pandas_csv_cache(folder, file_template, expiration_in_sec,
-                     read_csv_kwargs={'sep', '|'}, to_csv_kwargs={'sep': '|'}):
+                     read_csv_kwargs={'sep', '|'}, to_csv_kwargs={'sep': '|'},
+                     storage_format='csv', memory_cache_size=0,
+                     incremental_column=None, incremental_ascending=True):
+    # storage_format is one of 'csv', 'pickle' or 'parquet'. pickle and parquet
+    # round-trip the index and dtypes exactly; csv files written by earlier
+    # versions are still read (with read_csv_kwargs) and migrated on first use.
+    # memory_cache_size > 0 keeps that many frames in memory so repeated calls
+    # within a session never touch the disk.
+    # With incremental_column set (a column name or 'index'), an expired file is
+    # not thrown away: func is called with cached_df and last_timestamp keywords,
+    # returns only the rows from last_timestamp on, and those are merged and
+    # deduplicated into the cached frame, sorted on incremental_column in the
+    # order the source returns rows (incremental_ascending=False for tables
+    # listed newest first).
+    if storage_format not in _storage_extensions:
+        raise ValueError('Unknown storage_format: ' + str(storage_format))
+    memory_cache = _FrameLRU(memory_cache_size)
+    # Instrumentation names, e.g. cache.FinvizNews.miss
+    stage = 'cache.' + os.path.basename(os.path.normpath(folder)) + '.'
+
     def decorator_pandas_csv_cache(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -55,30 +172,74 @@ def pandas_csv_cache(folder, file_template, expiration_in_sec,
                 os.mkdir(folder)
             if '{ticker}' in file_template:
                 ticker = kwargs['ticker'] if 'ticker' in kwargs else args[0]
-                file_path = os.path.join(folder, file_template.format(ticker=ticker))
+                csv_file_path = os.path.join(folder, file_template.format(ticker=ticker))
             else:
-                file_path = os.path.join(folder, file_template)
+                csv_file_path = os.path.join(folder, file_template)
+            file_path = os.path.splitext(csv_file_path)[0] + _storage_extensions[storage_format]
+            
+            df = memory_cache.get(file_path, expiration_in_sec)
+            if df is not None:
+                profiler.count(stage + 'memory_hit')
+                return df
+            
+            if storage_format != 'csv' and not os.path.isfile(file_path) \
+                    and os.path.isfile(csv_file_path):
+                # Migrate a legacy csv cache, keeping its age for expiry. An 
+                # expired one is still kept when it can seed an incremental
+                # refresh
+                if incremental_column is not None or \
+                        time.time() - os.path.getmtime(csv_file_path) <= expiration_in_sec:
+                    csv_mtime = os.path.getmtime(csv_file_path)
+                    _write_frame(pd.read_csv(csv_file_path, **read_csv_kwargs), 
+                                 file_path, storage_format, to_csv_kwargs)
+                    os.utime(file_path, (csv_mtime, csv_mtime))
+                os.remove(csv_file_path)
+            
+            cached_df = None
             if os.path.isfile(file_path):
-                if time.time() - os.path.getmtime(file_path) <= expiration_in_sec:
-                    return pd.read_csv(file_path, **read_csv_kwargs)
+                file_mtime = os.path.getmtime(file_path)
+                file_size = os.path.getsize(file_path) if profiler.enabled else 0
+                if time.time() - file_mtime <= expiration_in_sec:
+                    profiler.count(stage + 'disk_hit')
+                    profiler.count(stage + 'bytes_read', file_size)
+                    df = _read_frame(file_path, storage_format, read_csv_kwargs)
+                    memory_cache.put(file_path, file_mtime, df)
+                    return df
+                profiler.count(stage + 'expired')
+                if incremental_column is not None:
+                    profiler.count(stage + 'bytes_read', file_size)
+                    cached_df = _read_frame(file_path, storage_format, read_csv_kwargs)
                 else:
                     os.remove(file_path)
-            df = func(*args, **kwargs)
-            df.to_csv(file_path, **to_csv_kwargs)
+            else:
+                profiler.count(stage + 'miss')
+            with profiler.timer(stage + 'fetch'):
+                if cached_df is None:
+                    df = func(*args, **kwargs)
+                else:
+                    new_df = func(*args, cached_df=cached_df, 
+                                  last_timestamp=_last_timestamp(cached_df, incremental_column), 
+                                  **kwargs)
+                    df = _merge_increment(cached_df, new_df, incremental_column, 
+                                          ascending=incremental_ascending)
+            _write_frame(df, file_path, storage_format, to_csv_kwargs)
+            memory_cache.put(file_path, time.time(), df)
             return df
+        wrapper.cache_clear = memory_cache.clear
         return wrapper
     return decorator_pandas_csv_cache
 
 
-def Rolling_Regression( Y_ts, X_ts_arr, window=42):
+def _rolling_regression_input(Y_ts, X_ts_arr):
     input_dict = {}
     X_cols = []
-    output_dict = {}
+    # Timestamp indexes are mapped to dates on a new Series, the callers'
+    # series are left untouched
     if type(Y_ts.index[0]) == pd._libs.tslibs.timestamps.Timestamp:
-        Y_ts.index = Y_ts.index.map(lambda x: x.date())
+        Y_ts = Y_ts.set_axis(Y_ts.index.date, axis=0)
     for ts in X_ts_arr:
         if type(ts.index[0]) == pd._libs.tslibs.timestamps.Timestamp:
-            ts.index = ts.index.map(lambda x: x.date())
+            ts = ts.set_axis(ts.index.date, axis=0)
         input_dict[ts.name] = ts
         X_cols.append(ts.name)
               
@@ -86,6 +247,13 @@ def Rolling_Regression( Y_ts, X_ts_arr, window=42):
     input_df = pd.DataFrame(input_dict).dropna()
     input_df['Constant'] = 1
     X_cols.append('Constant')
+    return input_df, X_cols
+
+
+@timed
+def Rolling_Regression( Y_ts, X_ts_arr, window=42):
+    output_dict = {}
+    input_df, X_cols = _rolling_regression_input(Y_ts, X_ts_arr)
     total_observations = len(input_df)
     nbr_regressions = total_observations - window
     
@@ -98,6 +266,83 @@ def Rolling_Regression( Y_ts, X_ts_arr, window=42):
     return output_dict
 
 
+def rolling_ols_arrays(Y, X, window=42):
+    # Batched version of OLS_regression over every sliding window at once.
+    # Y is (T,) or (T, n) for n series sharing the regressors, X is (T, k) and
+    # already holds the constant column. X'X is inverted once per window and
+    # reused for every column of Y.
+    # Row i of every output is the regression over rows i..i+window-1, which
+    # is the value Rolling_Regression stores under date i+window. With a 2-D Y
+    # the coefficient outputs are (T-window, k, n) and Sigma_hat_square is
+    # (T-window, n).
+    Y = np.asarray(Y, dtype=float)
+    X = np.asarray(X, dtype=float)
+    single_series = Y.ndim == 1
+    if single_series:
+        Y = Y[:, None]
+    k = X.shape[1]
+    n = Y.shape[1]
+    nbr_regressions = len(Y) - window
+    if nbr_regressions <= 0:
+        output_dict = {'Beta_hat': np.empty((0, k, n)),
+                       'Std_err_Beta_hat': np.empty((0, k, n)),
+                       't_stat_Beta_hat': np.empty((0, k, n)),
+                       'Sigma_hat_square': np.empty((0, n))}
+    else:
+        # (T-window, k, window) and (T-window, n, window) views, no copy
+        X_win = sliding_window_view(X[:-1], window, axis=0)
+        Y_win = sliding_window_view(Y[:-1], window, axis=0)
+        
+        XtX_inv = inv(np.einsum('tiw,tjw->tij', X_win, X_win))
+        XtY = np.einsum('tiw,tnw->tin', X_win, Y_win)
+        Beta_hat = np.einsum('tij,tjn->tin', XtX_inv, XtY)
+        
+        # Sum of squared residuals from the normal equations, Y'Y - Beta'X'Y,
+        # so the (T-window, n, window) residuals are never built
+        YtY = np.einsum('tnw,tnw->tn', Y_win, Y_win)
+        SSR = np.maximum(YtY - np.einsum('tin,tin->tn', Beta_hat, XtY), 0)
+        Sigma_hat_square = SSR / (window - k)
+        
+        Std_err_Beta_hat = (Sigma_hat_square[:, None, :] * \
+                            np.diagonal(XtX_inv, axis1=1, axis2=2)[:, :, None]) ** 0.5
+        t_stat_Beta_hat = Beta_hat / Std_err_Beta_hat
+        output_dict = {'Beta_hat': Beta_hat,
+                       'Std_err_Beta_hat': Std_err_Beta_hat,
+                       't_stat_Beta_hat': t_stat_Beta_hat,
+                       'Sigma_hat_square': Sigma_hat_square
+                       }
+    
+    if single_series:
+        output_dict = {label: arr[..., 0] for label, arr in output_dict.items()}
+    return output_dict
+
+
+def rolling_window_sum(arr, window):
+    # Sum of rows i..i+window-1 for every i, i.e. the window that ends the day
+    # before output date i+window. Returns T-window rows.
+    arr = np.asarray(arr, dtype=float)
+    cum_arr = np.concatenate([np.zeros((1,) + arr.shape[1:]), np.cumsum(arr, axis=0)])
+    return cum_arr[window:-1] - cum_arr[:-window-1]
+
+
+@timed
+def Rolling_Regression_Batched( Y_ts, X_ts_arr, window=42):
+    # Same regressions as Rolling_Regression, but returns dense
+    # (dates x regressors) DataFrames instead of a dict of OLS outputs per date
+    input_df, X_cols = _rolling_regression_input(Y_ts, X_ts_arr)
+    output_dates = input_df.index[window:]
+    output_arrays = rolling_ols_arrays(Y=input_df[Y_ts.name].values,
+                                       X=input_df[X_cols].values,
+                                       window=window)
+    output_dict = {}
+    for label in ['Beta_hat', 'Std_err_Beta_hat', 't_stat_Beta_hat']:
+        output_dict[label] = pd.DataFrame(output_arrays[label], 
+                                          index=output_dates, columns=X_cols)
+    output_dict['Sigma_hat_square'] = pd.Series(output_arrays['Sigma_hat_square'],
+                                                index=output_dates)
+    return output_dict
+
+
 def _DEP_align_date_index(obj_1, obj_2):
     idx = obj_1.index.intersection(obj_2.index)
     return obj_1.loc[idx], obj_2.loc[idx]
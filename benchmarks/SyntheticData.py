@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:40:12 2026
+
+"""
+
+import numpy as np
+import pandas as pd
+from Stock import Stock
+
+
+# Financial statement items used by the ratio signals, as multiples of the
+# quarterly revenue
+financial_items = {'TotalRevenue': 1.0, 'CostOfRevenue': 0.6, 'GrossProfit': 0.4,
+                   'OperatingIncome': 0.2, 'EBIT': 0.18, 'NetIncome': 0.12,
+                   'NetIncomeCommonStockholders': 0.12, 'DilutedNIAvailtoComStockholders': 0.12,
+                   'InterestExpense': 0.02, 'Leases': 0.01, 'FreeCashFlow': 0.1,
+                   'CashDividendsPaid': -0.04, 'TotalAssets': 4.0, 'CurrentAssets': 1.5,
+                   'CurrentLiabilities': 1.0, 'WorkingCapital': 0.5, 'Inventory': 0.3,
+                   'Receivables': 0.25, 'AccountsReceivable': 0.25, 'AccountsPayable': 0.2,
+                   'CashAndCashEquivalents': 0.4, 'TotalDebt': 1.2, 'CommonStockEquity': 1.8,
+                   'TotalEquityGrossMinorityInterest': 1.9, 'GoodwillAndOtherIntangibleAssets': 0.5,
+                   'ChangeInInventory': -0.01, 'ChangesInAccountReceivables': -0.01,
+                   'ChangeInAccountPayable': 0.01}
+
+headline_words = ['beats', 'misses', 'raises', 'cuts', 'guidance', 'upgrade', 'downgrade',
+                  'strong', 'weak', 'record', 'quarter', 'shares', 'rally', 'slump', 'outlook']
+
+
+class SyntheticStock(Stock):
+    # Stock compatible object built from generated frames, no network access
+
+    def __init__(self, ticker, returns_data, financial_data, zacks_earnings_cal,
+                 ratings_data, insider_trading_data, news_data):
+        self.ticker = ticker
+        self.load_errors = {}
+        self.returns_data = returns_data
+        self.financial_data = financial_data
+        self.zacks_earnings_cal = zacks_earnings_cal
+        self.ratings_data = ratings_data
+        self.insider_trading_data = insider_trading_data
+        self.news_data = news_data
+
+
+def synthetic_dates(T=756, end='2021-12-31'):
+    return pd.bdate_range(end=end, periods=T)
+
+
+def synthetic_Fama_French_df(dates, seed=0):
+    # Daily Mkt-RF, SMB, HML and RF in decimals on a DatetimeIndex, the
+    # layout of MacroData.get_Fama_French_df
+    rng = np.random.default_rng(seed)
+    T = len(dates)
+    return pd.DataFrame({'Mkt-RF': rng.normal(0.0004, 0.011, T),
+                         'SMB': rng.normal(0.0, 0.005, T),
+                         'HML': rng.normal(0.0, 0.006, T),
+                         'RF': np.full(T, 0.00005)}, index=pd.DatetimeIndex(dates))
+
+
+def synthetic_stock(ticker, factors_df, rng):
+    dates = factors_df.index
+    T = len(dates)
+    date_idx = pd.Index(dates.date, name='date')
+
+    # Prices follow the 3 factors with stock specific loadings plus noise
+    loadings = np.array([rng.normal(1.0, 0.3), rng.normal(0.0, 0.5), rng.normal(0.0, 0.5)])
+    returns = factors_df[['Mkt-RF', 'SMB', 'HML']].values.dot(loadings) + \
+              factors_df['RF'].values + rng.normal(0, 0.015, T)
+    close = 20 * np.exp(rng.normal(0, 1)) * np.exp(np.cumsum(returns))
+    spread = np.abs(rng.normal(0, 0.01, T))
+    returns_data = pd.DataFrame({'PriceOpen': close * (1 + rng.normal(0, 0.005, T)),
+                                 'PriceHigh': close * (1 + spread),
+                                 'PriceLow': close * (1 - spread),
+                                 'PriceClose': close,
+                                 'Volume': rng.integers(10**5, 10**7, T)}, index=date_idx)
+
+    # Quarterly statements released 45 days after quarter end, starting before
+    # the first price so every date has point in time fundamentals
+    quarter_ends = pd.date_range(dates[0] - pd.Timedelta(days=200), dates[-1], freq='Q')
+    release_dates = pd.DatetimeIndex(quarter_ends + pd.Timedelta(days=45), name='ReleaseDate')
+    revenue = 1e8 * np.exp(rng.normal(0, 1)) * np.exp(np.cumsum(rng.normal(0.01, 0.05, len(quarter_ends))))
+    financial_data = pd.DataFrame({item: revenue * ratio * np.exp(rng.normal(0, 0.1, len(quarter_ends)))
+                                   for item, ratio in financial_items.items()}, index=release_dates)
+    financial_data['ShareIssued'] = 1e7 * np.exp(rng.normal(0, 0.5)) * \
+                                    np.exp(np.cumsum(rng.normal(0, 0.01, len(quarter_ends))))
+    zacks_earnings_cal = pd.DataFrame({'ReleaseDate': release_dates.date,
+                                       'Quarter': [str(q.quarter) + 'Q' + str(q.year)
+                                                   for q in quarter_ends]})
+
+    nbr_ratings = max(T // 30, 1)
+    rating_pos = np.sort(rng.integers(0, T, nbr_ratings))
+    old_pt = close[rating_pos] * np.exp(rng.normal(0.05, 0.1, nbr_ratings))
+    ratings_data = pd.DataFrame({'RatingDate': date_idx[rating_pos],
+                                 'RatingChange': rng.choice(['Upgrade', 'Downgrade', 'Reiterated'], nbr_ratings),
+                                 'Company': rng.choice(['Firm A', 'Firm B', 'Firm C'], nbr_ratings),
+                                 'OldRating': 'Hold',
+                                 'NewRating': rng.choice(['Buy', 'Hold', 'Sell'], nbr_ratings),
+                                 'OldPT': old_pt,
+                                 'NewPT': old_pt * np.exp(rng.normal(0, 0.05, nbr_ratings))}
+                                ).iloc[::-1].reset_index(drop=True)
+
+    nbr_trades = max(T // 10, 1)
+    trade_pos = np.sort(rng.integers(0, T, nbr_trades))
+    number_shares = rng.integers(100, 50000, nbr_trades)
+    insider_trading_data = pd.DataFrame({'Date': date_idx[trade_pos],
+                                         'InsiderName': rng.choice(['Insider A', 'Insider B', 'Insider C'], nbr_trades),
+                                         'Relationship': rng.choice(['CEO', 'CFO', 'Director'], nbr_trades),
+                                         'Transaction': rng.choice(['Buy', 'Sale', 'Option Exercise'], nbr_trades),
+                                         'Cost': close[trade_pos],
+                                         'NumberShares': number_shares,
+                                         'Value': close[trade_pos] * number_shares,
+                                         'NumberTotalShares': rng.integers(10**5, 10**6, nbr_trades),
+                                         'SEC_Form4': ''}).iloc[::-1].reset_index(drop=True)
+
+    # Headlines come from a small vocabulary, so the same headline shows up
+    # under several tickers as wire stories do
+    nbr_news = max(T // 2, 1)
+    news_pos = np.sort(rng.integers(0, T, nbr_news))
+    headlines = [' '.join(rng.choice(headline_words, 4)) for _ in range(nbr_news)]
+    news_data = pd.DataFrame({'NewsDateTime': pd.DatetimeIndex(dates[news_pos]) +
+                                              pd.to_timedelta(rng.integers(0, 24*60, nbr_news), unit='m'),
+                              'NewsHeadlines': headlines,
+                              'Newslink': ['https://news.example.com/' + ticker + '/' + str(i)
+                                           for i in range(nbr_news)],
+                              'NewsPublication': rng.choice(['Wire A', 'Wire B'], nbr_news),
+                              'NewsSentiment': rng.uniform(-1, 1, nbr_news),
+                              'NewsSubjectivity': rng.uniform(0, 1, nbr_news)}
+                             ).iloc[::-1].reset_index(drop=True)
+
+    return SyntheticStock(ticker, returns_data, financial_data, zacks_earnings_cal,
+                          ratings_data, insider_trading_data, news_data)
+
+
+def synthetic_universe(N=100, T=756, seed=0):
+    # Deterministic for a given (N, T, seed): returns (list of N
+    # SyntheticStock, Fama French factors DataFrame on the same dates)
+    factors_df = synthetic_Fama_French_df(synthetic_dates(T), seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    stock_obj_arr = [synthetic_stock('SYN' + str(i).zfill(4), factors_df, rng) for i in range(N)]
+    return stock_obj_arr, factors_df
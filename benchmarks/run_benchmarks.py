@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:58:36 2026
+
+Times the analytics hot paths on synthetic universes and keeps a history of
+the timings, so a slowdown shows up against the previous run:
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 --days 756
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_folder))
+# Nothing is fetched, but the data modules need a library folder on import
+os.environ.setdefault('IKAROSDATA', tempfile.mkdtemp(prefix='IKAROSDATA_'))
+
+import numpy as np
+import pandas as pd
+import Signals
+from FactorModels import CAPM
+from MacroData import factor_store
+from Portfolio import SimpleBlackLitterman
+from Portfolio import return_mat_to_rolling_var_covar_cube
+from Portfolio import return_mat_to_rolling_var_covar_dict
+from Portfolio import stock_obj_arr_to_return_mat
+from SignalPanel import SignalPanel
+from SignalTransformers import Z_Score
+from Utils import Rolling_Regression
+from Utils import Rolling_Regression_Batched
+from SyntheticData import synthetic_universe
+
+
+ratio_signals = [getattr(Signals, name) for name in dir(Signals)
+                 if name.endswith('_Signal') and hasattr(getattr(Signals, name), '__wrapped__')]
+
+
+def _mkt_rf():
+    return Signals.get_Fama_French_ts('Mkt-RF')
+
+def bench_Rolling_Regression(stock_obj_arr):
+    for s in stock_obj_arr:
+        Rolling_Regression(s['PriceClose'].pct_change(1).dropna(), [_mkt_rf()], window=42)
+
+def bench_Rolling_Regression_Batched(stock_obj_arr):
+    for s in stock_obj_arr:
+        Rolling_Regression_Batched(s['PriceClose'].pct_change(1).dropna(), [_mkt_rf()], window=42)
+
+def bench_CAPM(stock_obj_arr):
+    CAPM(stock_obj_arr, window=126)
+
+def bench_var_covar_dict(stock_obj_arr):
+    return_mat_to_rolling_var_covar_dict(stock_obj_arr_to_return_mat(stock_obj_arr), window=126)
+
+def bench_var_covar_cube(stock_obj_arr):
+    return_mat_to_rolling_var_covar_cube(stock_obj_arr_to_return_mat(stock_obj_arr), window=126)
+
+def bench_SimpleBlackLitterman(stock_obj_arr):
+    SimpleBlackLitterman(stock_obj_arr, [Signals.Momentum_12M_1M, Signals.Price_to_Book_Signal],
+                         [0.02, 0.01])
+
+def bench_Z_Score(stock_obj_arr):
+    Z_Score(pd.DataFrame({s.ticker: s['PriceClose'] for s in stock_obj_arr}), window=21)
+
+def bench_ratio_signals(stock_obj_arr):
+    for s in stock_obj_arr:
+        for signal_func in ratio_signals:
+            signal_func(s)
+
+def bench_ratio_signals_panel(stock_obj_arr):
+    panel = SignalPanel(stock_obj_arr)
+    for signal_func in ratio_signals:
+        panel.evaluate(signal_func)
+
+def bench_Momentum_12M_1M(stock_obj_arr):
+    for s in stock_obj_arr:
+        Signals.Momentum_12M_1M(s)
+
+def bench_Price_target_to_Price_Signal(stock_obj_arr):
+    for s in stock_obj_arr:
+        Signals.Price_target_to_Price_Signal(s)
+
+def bench_Insider_Flow_Signal(stock_obj_arr):
+    for s in stock_obj_arr:
+        Signals.Insider_Flow_Signal(s)
+
+def bench_Insider_Flow_Panel(stock_obj_arr):
+    Signals.Insider_Flow_Panel(stock_obj_arr)
+
+def bench_Fama_French_Rolling_Beta(stock_obj_arr):
+    for s in stock_obj_arr:
+        Signals.Fama_French_Rolling_Beta(s, 'HML', window=42)
+
+def bench_Fama_French_Rolling_Beta_Panel(stock_obj_arr):
+    Signals.Fama_French_Rolling_Beta_Panel(stock_obj_arr, window=42)
+
+
+# name: (function of the stock list, largest universe it is run on, number
+# of (dates x N x N) covariance stacks it holds at its peak). Loops over per
+# date pandas objects are capped so a full run stays in minutes, and the
+# N x N cases are skipped where their stacks would not fit in max_memory_gb.
+benchmark_cases = {'Rolling_Regression': (bench_Rolling_Regression, 10, 0),
+                   'Rolling_Regression_Batched': (bench_Rolling_Regression_Batched, 1000, 0),
+                   'CAPM': (bench_CAPM, 1000, 3),
+                   'return_mat_to_rolling_var_covar_dict': (bench_var_covar_dict, 100, 2),
+                   'return_mat_to_rolling_var_covar_cube': (bench_var_covar_cube, 1000, 3),
+                   'SimpleBlackLitterman': (bench_SimpleBlackLitterman, 100, 3),
+                   'Z_Score': (bench_Z_Score, 1000, 0),
+                   'Ratio_Signals': (bench_ratio_signals, 100, 0),
+                   'Ratio_Signals_SignalPanel': (bench_ratio_signals_panel, 1000, 0),
+                   'Momentum_12M_1M': (bench_Momentum_12M_1M, 1000, 0),
+                   'Price_target_to_Price_Signal': (bench_Price_target_to_Price_Signal, 1000, 0),
+                   'Insider_Flow_Signal': (bench_Insider_Flow_Signal, 1000, 0),
+                   'Insider_Flow_Panel': (bench_Insider_Flow_Panel, 1000, 0),
+                   'Fama_French_Rolling_Beta': (bench_Fama_French_Rolling_Beta, 1000, 0),
+                   'Fama_French_Rolling_Beta_Panel': (bench_Fama_French_Rolling_Beta_Panel, 1000, 0)}
+
+# The covariance cases all use a 126 day window
+var_covar_window = 126
+
+
+def case_memory_gb(case, N, T):
+    # Estimated peak memory of the covariance stacks of a case, in GB
+    nbr_stacks = benchmark_cases[case][2]
+    return nbr_stacks * max(T - var_covar_window, 0) * N * N * 8 / 1e9
+
+
+def time_case(func, stock_obj_arr, repeat=3):
+    # Best of repeat wall clock seconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(stock_obj_arr)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(sizes=[10, 100, 1000], T=756, repeat=3, cases=None, seed=0, 
+                   max_memory_gb=2.0):
+    # Returns {case: {N: seconds}}; cases above their size cap, or whose
+    # covariance stacks would take more than max_memory_gb, are left out
+    if cases is None:
+        cases = list(benchmark_cases.keys())
+    results = {case: {} for case in cases}
+    for N in sizes:
+        stock_obj_arr, factors_df = synthetic_universe(N=N, T=T, seed=seed)
+        factor_store.set('3_Factors', factors_df)
+        for case in cases:
+            func, max_N, _ = benchmark_cases[case]
+            if N > max_N:
+                continue
+            memory_gb = case_memory_gb(case, N, T)
+            if memory_gb > max_memory_gb:
+                print('{:<40} N={:<6} skipped, needs ~{:.1f}GB'.format(case, N, memory_gb))
+                continue
+            results[case][str(N)] = time_case(func, stock_obj_arr, repeat=repeat)
+            print('{:<40} N={:<6} {:>10.4f}s'.format(case, N, results[case][str(N)]))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=benchmarks_folder, stderr=subprocess.DEVNULL)\
+                         .decode().strip()
+    except Exception:
+        return None
+
+
+def load_history(history_path):
+    if not os.path.isfile(history_path):
+        return []
+    with open(history_path) as f:
+        return json.load(f)
+
+
+def compare_runs(results, previous_results, threshold=1.25):
+    # One row per (case, N) of the current run against the previous one,
+    # Regression is True where a case got slower by more than threshold
+    data = []
+    for case, timings in results.items():
+        for N, seconds in timings.items():
+            previous = previous_results.get(case, {}).get(N)
+            ratio = seconds / previous if previous else np.nan
+            data.append({'Case': case, 'N': int(N), 'Seconds': seconds,
+                         'PreviousSeconds': previous, 'Ratio': ratio,
+                         'Regression': bool(ratio > threshold)})
+    return pd.DataFrame(data, columns=['Case', 'N', 'Seconds', 'PreviousSeconds',
+                                       'Ratio', 'Regression'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic universes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--days', type=int, default=756)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cases', nargs='+', default=None, choices=list(benchmark_cases.keys()))
+    parser.add_argument('--history', default=os.path.join(benchmarks_folder, 'history.json'))
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--max-memory-gb', type=float, default=2.0)
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(sizes=args.sizes, T=args.days, repeat=args.repeat, cases=args.cases,
+                             max_memory_gb=args.max_memory_gb)
+
+    # Compare with the last run on the same number of days
+    history = load_history(args.history)
+    previous = [run for run in history if run['days'] == args.days]
+    comparison_df = compare_runs(results, previous[-1]['results'] if previous else {},
+                                 threshold=args.threshold)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(comparison_df.to_string(index=False))
+
+    if not args.no_save:
+        history.append({'timestamp': datetime.now().isoformat(timespec='seconds'),
+                        'commit': _git_commit(),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'pandas': pd.__version__,
+                        'days': args.days,
+                        'repeat': args.repeat,
+                        'results': results})
+        with open(args.history, 'w') as f:
+            json.dump(history, f, indent=1)
+
+    if args.fail_on_regression and comparison_df['Regression'].any():
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())